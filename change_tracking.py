@@ -0,0 +1,185 @@
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+from config import db_name
+
+# sqlite limits the number of bound parameters per statement, look up hashes in chunks of this size
+HASH_LOOKUP_CHUNK = 500
+
+
+def start_crawl_run():
+    """
+    Register the start of a new crawl run. Changes written by the loaders are attributed to the latest run.
+
+    :return: int, id of the new crawl run
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.execute(
+        "INSERT INTO crawl_runs(started) VALUES (?)",
+        (datetime.now(timezone.utc).isoformat(),)
+    )
+    run = cur.lastrowid
+    conn.commit()
+    conn.close()
+
+    return run
+
+
+def current_run(conn):
+    """
+    Get id of the latest crawl run, starting one if none exists.
+
+    :param conn: open sqlite3 connection to DB
+    :return: int, id of the latest crawl run
+    """
+    run = conn.execute("SELECT MAX(id) FROM crawl_runs").fetchone()[0]
+
+    if run is None:
+        run = conn.execute(
+            "INSERT INTO crawl_runs(started) VALUES (?)",
+            (datetime.now(timezone.utc).isoformat(),)
+        ).lastrowid
+
+    return run
+
+
+def content_hash(record):
+    """
+    Compute a compact, order-insensitive hash of a record prepared for insertion into DB.
+    Lists are treated as sets of rows and dictionaries are hashed by key.
+
+    :param record: tuple, list of tuples, or dictionary of either, as produced by the process functions
+    :return: str, hex digest of record content
+    """
+    if isinstance(record, dict):
+        record = sorted((key, content_hash(val)) for key, val in record.items())
+    elif isinstance(record, list):
+        record = sorted(map(repr, record))
+
+    return hashlib.blake2b(repr(record).encode(), digest_size=8).hexdigest()
+
+
+def find_changed(conn, entity, records):
+    """
+    Given records keyed by GUID, keep only those whose content hash differs from the hash stored for that key.
+    Writes nothing: once the changed records are written to DB, pass the result to record_changes().
+
+    :param conn: open sqlite3 connection to DB
+    :param entity: name of the entity the records belong to, e.g. a table name
+    :param records: list of tuples of form (guid, record)
+    :return: list of tuples of form (guid, record, hash, action) of changed records, in input order,
+             action is 'insert' for GUIDs without a stored hash, 'update' otherwise
+    """
+    hashes = {key: content_hash(record) for key, record in records}
+    keys = list(hashes)
+
+    stored = dict()
+    for i in range(0, len(keys), HASH_LOOKUP_CHUNK):
+        chunk = keys[i:i + HASH_LOOKUP_CHUNK]
+        cur = conn.execute(
+            f"SELECT id, hash FROM content_hashes WHERE entity = ? AND id IN ({','.join('?' * len(chunk))})",
+            [entity] + chunk
+        )
+        stored.update(cur.fetchall())
+
+    return [
+        (key, record, hashes[key], 'update' if key in stored else 'insert')
+        for key, record in records
+        if stored.get(key) != hashes[key]
+    ]
+
+
+def record_changes(conn, entity, changed):
+    """
+    Store the new hashes of changed records and log an insert or update for each in the changelog of the latest run.
+    Call after the records were written, in the same transaction, so hashes are never committed without their rows.
+    Does not commit.
+
+    :param conn: open sqlite3 connection to DB
+    :param entity: name of the entity the records belong to, e.g. a table name
+    :param changed: list of changed records from find_changed()
+    :return: None
+    """
+    if not changed:
+        return
+
+    run = current_run(conn)
+
+    conn.executemany(
+        """
+        INSERT INTO content_hashes(entity, id, hash) VALUES (?, ?, ?)
+        ON CONFLICT(entity, id) DO UPDATE SET hash=excluded.hash
+        """,
+        [(entity, key, digest) for key, _, digest, _ in changed]
+    )
+    conn.executemany(
+        "INSERT INTO changelog(run, entity, id, action, num_rows) VALUES (?, ?, ?, ?, 1)",
+        [(run, entity, key, action) for key, _, _, action in changed]
+    )
+
+
+def log_new_links(conn, entity, guid, num_rows):
+    """
+    Log the number of relationship rows (tags, child nodes, contributors) newly added for some GUID
+    in the changelog of the latest run. Does not commit.
+
+    :param conn: open sqlite3 connection to DB
+    :param entity: name of the relationship table
+    :param guid: OSF GUID the relationships belong to
+    :param num_rows: number of rows inserted, e.g. cursor rowcount of INSERT OR IGNORE
+    :return: None
+    """
+    if num_rows > 0:
+        conn.execute(
+            "INSERT INTO changelog(run, entity, id, action, num_rows) VALUES (?, ?, ?, 'link', ?)",
+            (current_run(conn), entity, guid, num_rows)
+        )
+
+
+def get_changes(since_run, until_run=None, entity=None):
+    """
+    Gather changes written after some crawl run, e.g. to compare the state of DB between two runs.
+
+    :param since_run: id of crawl run to compare against, changes of this run are excluded
+    :param until_run: id of last crawl run to include, defaults to latest run
+    :param entity: optional entity name to restrict changes to
+    :return: list of tuples of form (run, entity, id, action, num_rows)
+    """
+    query = "SELECT run, entity, id, action, num_rows FROM changelog WHERE run > ?"
+    params = [since_run]
+
+    if until_run is not None:
+        query += " AND run <= ?"
+        params.append(until_run)
+
+    if entity is not None:
+        query += " AND entity = ?"
+        params.append(entity)
+
+    conn = sqlite3.connect(db_name)
+    changes = conn.execute(query + " ORDER BY run, entity, id;", params).fetchall()
+    conn.close()
+
+    return changes
+
+
+def summarize_changes(since_run, until_run=None):
+    """
+    Count changes per run, entity, and action written after some crawl run.
+
+    :param since_run: id of crawl run to compare against, changes of this run are excluded
+    :param until_run: id of last crawl run to include, defaults to latest run
+    :return: list of tuples of form (run, entity, action, num_records, num_rows)
+    """
+    query = "SELECT run, entity, action, COUNT(*), SUM(num_rows) FROM changelog WHERE run > ?"
+    params = [since_run]
+
+    if until_run is not None:
+        query += " AND run <= ?"
+        params.append(until_run)
+
+    conn = sqlite3.connect(db_name)
+    summary = conn.execute(query + " GROUP BY run, entity, action ORDER BY run, entity, action;", params).fetchall()
+    conn.close()
+
+    return summary
@@ -1,10 +1,26 @@
 import sqlite3
-from config import db_name, seed_project
-from multiprocessing import Pool
-from math import ceil
-from project_functions import get_project_record, load_project_record, map_get_project_record
-from user_functions import map_reduce_get_user_resources, load_user_resources
+import time
+import itertools
+import functools
+import collections
+from datetime import datetime, timezone
+from math import ceil, log1p
+from config import base_url, db_name, seed_project
+from project_functions import get_project_record, load_project_record, map_get_project_record, \
+    map_get_resource_record, stream_project_response, process_children_page, \
+    get_children_pages, process_contributors_page, iter_contributors_pages, load_resource_record, CONTRIBUTOR_TABLES
+from user_functions import map_reduce_get_user_all_resources, map_get_user_resources, load_user_resources, \
+    load_user_profile, process_user_response, process_user_profiles, RESOURCE_DATE_FIELDS, MAX_PAGE_SIZE
+from dead_letter import get_json, get_failures, clear_failure, record_missing
+from crawl_executor import start_executor, get_executor, shutdown_executor
+from change_tracking import start_crawl_run
 
+# nodes whose single or batched request is recorded as failed, replayed by retry_failed_requests() if transient
+FAILED_NODES = """
+               SELECT json_extract(context, '$.guid') FROM failed_requests WHERE kind = 'project'
+                UNION
+               SELECT g.value FROM failed_requests f, json_each(f.context, '$.guids') g WHERE f.kind = 'projects'
+               """
 
 def get_seed_users():
     """
@@ -19,31 +35,115 @@ def get_seed_users():
 
     # identify COS staff based on those listed on staff project
 
-    users = [u['user'][0] for u in initial_project['users']]
+    users = [c[0] for c in initial_project.get('contributors', [])]
 
-    for ix, guid in enumerate(users):
-        print(f'fetching nodes for user {ix} - {guid}')
-        nodes = map_reduce_get_user_resources(guid, 'nodes')
-        load_user_resources(nodes, 'nodes')
+    crawl_users(users)
 
 
-def get_seed_projects(num_processes=2):
+def crawl_users(guids, num_processes=2, refresh=False):
+    """
+    Load profiles of users not yet stored in DB nor recorded as failed,
+    requested in batches with process_user_profiles().
+    For each user, gather nodes, registrations, and preprints in one pass and load into DB.
+    Then gather contributors of all collected resources (and child nodes and tags, for nodes)
+    that have not yet been extended, all resource types sharing one executor.
+
+    :param guids: iterable of OSF user GUIDs
+    :param num_processes: how many chunks to split work into, and workers to start if no executor is running
+    :param refresh: if True, extend all collected resources and re-collect profiles of contributors already stored in DB
+    :return: None
+    """
+    guids = list(guids)
+
+    conn = sqlite3.connect(db_name)
+    skip = {u[0] for u in conn.execute("SELECT id FROM users;").fetchall()} if not refresh else set()
+    # users whose profile request failed are replayed by retry_failed_requests() instead, or never if permanent
+    skip.update(u[0] for u in conn.execute(
+        """
+        SELECT json_extract(context, '$.guid') FROM failed_requests WHERE kind = 'user'
+         UNION
+        SELECT g.value FROM failed_requests f, json_each(f.context, '$.guids') g WHERE f.kind = 'users';
+        """
+    ).fetchall())
+    conn.close()
+
+    for user_insert in process_user_profiles([guid for guid in guids if guid not in skip]):
+        load_user_profile(user_insert)
+
+    resources = dict()
+
+    for ix, guid in enumerate(guids):
+        print(f'fetching resources for user {ix} - {guid}')
+        user_resources = map_reduce_get_user_all_resources(guid, num_processes)
+
+        for resource_type, records in user_resources.items():
+            load_user_resources(records, resource_type)
+            resources.update(((r[0], resource_type), None) for r in records)
+
+    resources = list(resources)
+
+    if not refresh:
+        # skip resources whose contributors were already gathered
+        resources = get_unextended_resources(resources)
+
+    chunk_len = ceil(len(resources) / num_processes)
+
+    if chunk_len:
+
+        chunks = [resources[i:i + chunk_len] for i in range(0, len(resources), chunk_len)]
+
+        executor = get_executor(num_processes)
+        list(executor.map(functools.partial(map_get_resource_record, refresh=refresh), chunks))
+
+
+def get_unextended_resources(resources):
+    """
+    Identify resources whose contributors have not yet been gathered.
+
+    :param resources: list of tuples of form (guid, resource_type), resource_type one of CONTRIBUTOR_TABLES
+    :return: list of tuples of form (guid, resource_type) of resources without known contributors
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TEMP TABLE crawl_resources(id TEXT, resource_type TEXT);")
+    conn.executemany("INSERT INTO crawl_resources(id, resource_type) VALUES (?, ?)", resources)
+
+    unextended = []
+    for resource_type, table in CONTRIBUTOR_TABLES.items():
+        cur = conn.execute(
+            f"""
+            SELECT id, resource_type
+              FROM crawl_resources
+             WHERE resource_type = ? AND
+                   id NOT IN (SELECT node FROM {table});
+            """,
+            (resource_type,)
+        )
+        unextended += cur.fetchall()
+    conn.close()
+
+    return unextended
+
+
+def get_seed_projects(num_processes=2, refresh=False):
     """
     Using nodes gathered from staff list from initial project, gather contributors and child nodes.
+    Nodes whose request failed are left out, as in get_frontier_nodes().
 
-    :param num_processes: how many processes to instantiate in process pool
+    :param num_processes: how many chunks to split work into, and workers to start if no executor is running
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
     :return: None
     """
     # gather node guids from collected user nodes to enhance with additional data
     conn = sqlite3.connect(db_name)
     cur = conn.cursor()
     # refine to be nodes not in known projects
-    cur.execute("""
+    cur.execute(f"""
                 SELECT id
                   FROM nodes
                  WHERE id NOT IN (SELECT parent from node_relations) AND
                        id NOT IN (SELECT child from node_relations) AND
-                       id NOT IN (SELECT node from node_contributors);
+                       id NOT IN (SELECT node from node_contributors) AND
+                       id NOT IN ({FAILED_NODES});
                 """)
     nodes = cur.fetchall()
 
@@ -57,31 +157,45 @@ def get_seed_projects(num_processes=2):
 
         chunks = [nodes[i:i + chunk_len] for i in range(0, len(nodes), chunk_len)]
 
-        with Pool(num_processes) as pool:
-            pool.map(map_get_project_record, chunks)
+        executor = get_executor(num_processes)
+        list(executor.map(functools.partial(map_get_project_record, refresh=refresh), chunks))
 
 
-def get_next_level(num_processes=2):
+def get_frontier_nodes():
     """
-    Identify nodes for which extension data (contributors and child nodes) has not yet been gathered,
-    extend node records and load into DB.
+    Identify nodes for which extension data (contributors and child nodes) has not yet been gathered.
+    Nodes whose request failed are left out, they are replayed by retry_failed_requests() instead.
 
-    :param num_processes: how many processes to instantiate in process pool
-    :return: None
+    :return: list of OSF node GUIDs
     """
     conn = sqlite3.connect(db_name)
     cur = conn.cursor()
     cur.execute(
-        """
+        f"""
         SELECT id 
           FROM nodes 
          WHERE id NOT IN (SELECT DISTINCT parent FROM node_relations) AND
-               id NOT IN (SELECT DISTINCT node FROM node_contributors);
+               id NOT IN (SELECT DISTINCT node FROM node_contributors) AND
+               id NOT IN ({FAILED_NODES});
         """)
     new_nodes = cur.fetchall()
     conn.close()
 
-    node_guids = [n[0] for n in new_nodes]
+    return [n[0] for n in new_nodes]
+
+
+def get_next_level(num_processes=2, refresh=False):
+    """
+    Identify nodes for which extension data (contributors and child nodes) has not yet been gathered,
+    extend node records and load into DB.
+
+    :param num_processes: how many chunks to split work into, and workers to start if no executor is running
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: None
+    """
+    start_crawl_run()
+
+    node_guids = get_frontier_nodes()
 
     chunk_len = ceil(len(node_guids) / num_processes)
 
@@ -89,14 +203,338 @@ def get_next_level(num_processes=2):
 
         chunks = [node_guids[i:i + chunk_len] for i in range(0, len(node_guids), chunk_len)]
 
-        with Pool(num_processes) as pool:
-            pool.map(map_get_project_record, chunks)
+        executor = get_executor(num_processes)
+        list(executor.map(functools.partial(map_get_project_record, refresh=refresh), chunks))
+
+
+def get_staff_hops():
+    """
+    Hop distance from COS staff of every user and node connected to staff, by breadth-first search
+    over user-node and parent-child links in DB.
+
+    :return: tuple,
+             (1) dictionary of GUID to hop distance, staff at distance 0
+             (2) dictionary of GUID to set of neighbor GUIDs, to keep distances current with update_staff_hops()
+    """
+    conn = sqlite3.connect(db_name)
+    staff = [s[0] for s in conn.execute("SELECT id FROM cos_staff;").fetchall()]
+    contributors = conn.execute("SELECT user, node FROM node_contributors;").fetchall()
+    relations = conn.execute("SELECT parent, child FROM node_relations;").fetchall()
+    conn.close()
+
+    neighbors = dict()
+    for a, b in itertools.chain(contributors, relations):
+        neighbors.setdefault(a, set()).add(b)
+        neighbors.setdefault(b, set()).add(a)
+
+    hops = dict.fromkeys(staff, 0)
+    level = staff
+    while level:
+        next_level = []
+        for v in level:
+            for w in neighbors.get(v, ()):
+                if w not in hops:
+                    hops[w] = hops[v] + 1
+                    next_level.append(w)
+        level = next_level
+
+    return hops, neighbors
+
+
+def update_staff_hops(hops, neighbors, node_guids):
+    """
+    Update hop distances from get_staff_hops() in place after nodes were extended: add their contributor
+    and child node links, and propagate shorter distances from both ends of each new link.
+    Links are not removed during a crawl, so distances only decrease and only regions near new links change.
+
+    :param hops: dictionary of GUID to hop distance, from get_staff_hops()
+    :param neighbors: dictionary of GUID to set of neighbor GUIDs, from get_staff_hops()
+    :param node_guids: iterable of GUIDs of nodes extended since distances were last updated
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TEMP TABLE extended(id TEXT PRIMARY KEY);")
+    conn.executemany("INSERT OR IGNORE INTO extended(id) VALUES (?)", ((n,) for n in node_guids))
+    links = conn.execute(
+        """
+        SELECT user, node FROM node_contributors WHERE node IN (SELECT id FROM extended)
+         UNION ALL
+        SELECT parent, child FROM node_relations WHERE parent IN (SELECT id FROM extended);
+        """
+    ).fetchall()
+    conn.close()
+
+    queue = collections.deque()
+    for a, b in links:
+        neighbors.setdefault(a, set()).add(b)
+        neighbors.setdefault(b, set()).add(a)
+        for v, w in [(a, b), (b, a)]:
+            if v in hops and hops[v] + 1 < hops.get(w, float('inf')):
+                hops[w] = hops[v] + 1
+                queue.append(w)
+
+    while queue:
+        v = queue.popleft()
+        for w in neighbors.get(v, ()):
+            if hops[v] + 1 < hops.get(w, float('inf')):
+                hops[w] = hops[v] + 1
+                queue.append(w)
+
+
+def score_frontier(node_guids, hop_weight=1.0, staff_parent_weight=2.0, contributor_weight=0.5, hops=None):
+    """
+    Score frontier nodes by expected yield of expanding them. Features are:
+    (1) hop distance from COS staff in the graph of users, nodes, and node relations,
+    (2) number of parent nodes with a COS staff contributor,
+    (3) number of distinct known contributors of parent nodes, as frontier nodes have no known contributors yet.
+    Score is staff_parent_weight * (2) + contributor_weight * log(1 + (3)) - hop_weight * (1).
+
+    :param node_guids: iterable of frontier node GUIDs, e.g. from get_frontier_nodes()
+    :param hop_weight: weight of hop distance from COS staff
+    :param staff_parent_weight: weight of number of staff-linked parent nodes
+    :param contributor_weight: weight of log number of known parent contributors
+    :param hops: optional hop distances kept current with update_staff_hops(), computed with get_staff_hops() if None
+    :return: list of tuples of form (guid, score), highest score first
+    """
+    if hops is None:
+        hops, _ = get_staff_hops()
+
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TEMP TABLE frontier(id TEXT PRIMARY KEY);")
+    conn.executemany("INSERT OR IGNORE INTO frontier(id) VALUES (?)", ((n,) for n in node_guids))
+    cur = conn.execute(
+        """
+        SELECT r.child,
+               COUNT(DISTINCT CASE WHEN s.id IS NOT NULL THEN r.parent END),
+               COUNT(DISTINCT nc.user)
+          FROM node_relations r
+          JOIN frontier f ON r.child=f.id
+          LEFT JOIN node_contributors nc ON r.parent=nc.node
+          LEFT JOIN cos_staff s ON nc.user=s.id
+         GROUP BY r.child;
+        """
+    )
+    parent_features = {f[0]: f[1:] for f in cur.fetchall()}
+    conn.close()
+
+    # unreachable nodes rank after every node connected to staff
+    max_hop = max(hops.values(), default=0) + 1
+
+    scores = []
+    for guid in dict.fromkeys(node_guids):
+        staff_parents, parent_contributors = parent_features.get(guid, (0, 0))
+        score = (
+            staff_parent_weight * staff_parents
+            + contributor_weight * log1p(parent_contributors)
+            - hop_weight * hops.get(guid, max_hop)
+        )
+        scores.append((guid, score))
+
+    scores.sort(key=lambda x: x[1], reverse=True)
+
+    return scores
+
+
+def get_next_level_prioritized(max_requests=None, max_seconds=None, batch_size=50, rescore_every=10,
+                               num_processes=2, refresh=False):
+    """
+    Extend frontier nodes in order of priority from score_frontier() until a request or time budget is spent.
+    Nodes are extended in batches; the frontier is re-scored every rescore_every batches so that
+    promising nodes discovered along the way are prioritized too. Hop distances from staff are computed once
+    and updated with the links of each extended batch (see update_staff_hops()), so re-scoring does not
+    search the whole collaboration graph again.
+    Budgets are checked between batches, so they may be exceeded by up to one batch. Failed requests count
+    against the request budget, and each node is attempted at most once per call, even if it stays on the frontier.
+
+    :param max_requests: maximum number of requests to make, unlimited if None
+    :param max_seconds: maximum time to spend in seconds, unlimited if None
+    :param batch_size: number of nodes extended between budget checks
+    :param rescore_every: number of batches extended before frontier is re-scored
+    :param num_processes: how many chunks to split each batch into, and workers to start if no executor is running
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: tuple, (number of nodes extended, number of requests made)
+    """
+    start_crawl_run()
+
+    start = time.monotonic()
+    num_nodes = num_requests = 0
+
+    executor = get_executor(num_processes)
+    extend = functools.partial(map_get_project_record, refresh=refresh)
+
+    def budget_left():
+        if max_requests is not None and num_requests >= max_requests:
+            return False
+        if max_seconds is not None and time.monotonic() - start >= max_seconds:
+            return False
+        return True
+
+    # nodes already attempted in this call, e.g. deleted or private nodes that load nothing
+    attempted = set()
+
+    # hop distances from staff are computed once and updated with the links of each extended batch
+    hops, neighbors = get_staff_hops()
+
+    while budget_left():
+        frontier = [n for n in get_frontier_nodes() if n not in attempted]
+        ranked = [guid for guid, score in score_frontier(frontier, hops=hops)]
+        if not ranked:
+            break
+
+        for i in range(0, min(len(ranked), batch_size * rescore_every), batch_size):
+            if not budget_left():
+                break
+
+            batch = ranked[i:i + batch_size]
+            chunk_len = ceil(len(batch) / num_processes)
+            chunks = [batch[j:j + chunk_len] for j in range(0, len(batch), chunk_len)]
+
+            attempted.update(batch)
+            num_requests += sum(executor.map(extend, chunks))
+            num_nodes += len(batch)
+            update_staff_hops(hops, neighbors, batch)
+            print(f'extended {num_nodes} nodes with {num_requests} requests')
+
+    return num_nodes, num_requests
+
+
+def retry_request(kind, url, params, context, refresh=False):
+    """
+    Replay one failed request from the dead letter table, process the response as the original request would have,
+    and load it into DB. Pagination requests continue through all following pages, including the pages
+    of a user's resources that were never requested because the first page failed.
+    Resources recovered from a user's resource listing are extended with their contributors, as in crawl_users().
+    Failures are recorded in the dead letter table again.
+
+    :param kind: type of failed request, see dead_letter.record_failure()
+    :param url: URL of failed request
+    :param params: query parameters of failed request, or None
+    :param context: values needed to process the response, as recorded
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: bool, True if the failed request itself succeeded
+    """
+    response_json = get_json(url, kind, context, params)
+
+    if not response_json:
+        return False
+
+    if kind == 'project':
+        stream_project_response(response_json['data'], refresh)
+
+    elif kind == 'projects':
+        for project in response_json['data']:
+            stream_project_response(project, refresh)
+        record_missing(
+            'project', base_url + '/nodes/', context['guids'], [project['id'] for project in response_json['data']]
+        )
+
+    elif kind == 'user':
+        load_user_profile(process_user_response(response_json['data']))
+
+    elif kind == 'users':
+        for user in response_json['data']:
+            load_user_profile(process_user_response(user))
+        record_missing('user', base_url + '/users/', context['guids'], [user['id'] for user in response_json['data']])
+
+    elif kind == 'user_resources':
+        date_field = RESOURCE_DATE_FIELDS[context['resource_type']]
+        resources = [
+            (node['id'], node['attributes']['title'], node['attributes'][date_field]) for node in response_json['data']
+        ]
+
+        # the first page determines how many pages follow, which were never requested when it failed
+        if int(params.get('page', 1)) == 1:
+            page_size = int(params.get('page[size]', MAX_PAGE_SIZE))
+            num_pages = ceil(response_json['links']['meta']['total'] / page_size)
+            if num_pages > 1:
+                more_resources = map_get_user_resources(
+                    context['guid'], context['resource_type'], range(2, num_pages + 1), page_size
+                )
+                resources += [r for r in more_resources if r is not None]
+
+        load_user_resources(resources, context['resource_type'])
+
+        # gather contributors of recovered resources, as crawl_users() would have,
+        # registrations and preprints are not found by later frontier queries
+        recovered = [(r[0], context['resource_type']) for r in resources]
+        map_get_resource_record(recovered if refresh else get_unextended_resources(recovered), refresh)
+
+    elif kind == 'node_children_page':
+        parent = context['parent']
+        children, nodes = process_children_page(parent, response_json['data'])
+        more_children, more_nodes = get_children_pages(parent, response_json['links']['next'])
+
+        load_project_record(
+            {'tags': [], 'children': children + more_children, 'nodes': nodes + more_nodes, 'contributors': [], 'users': []}
+        )
+
+    elif kind in ['node_contributors_page', 'resource_contributors_page']:
+        this_node = context.get('node', context.get('guid'))
+        pages = itertools.chain(
+            [process_contributors_page(this_node, response_json['data'], refresh)],
+            iter_contributors_pages(this_node, response_json['links']['next'], kind, context, refresh)
+        )
+
+        for contributors, users in pages:
+            resource_insert = {'contributors': contributors, 'users': users}
+            if kind == 'node_contributors_page':
+                load_project_record({'tags': [], 'children': [], 'nodes': [], **resource_insert})
+            else:
+                load_resource_record(resource_insert, context['resource_type'])
+
+    else:
+        print(f'{kind} requests are not supported, skipping {url}')
+        return False
+
+    return True
+
+
+def retry_failed_requests(max_attempts=5, base_delay=2, refresh=False):
+    """
+    Replay requests recorded in the dead letter table, oldest first, with exponential backoff per request:
+    a request attempted n times is replayed no sooner than base_delay * 2 ** (n - 1) seconds after its last attempt.
+    Successfully replayed requests are removed from the dead letter table. Permanent failures, e.g. private
+    or deleted nodes, are not replayed; a replay that fails permanently retires its request the same way.
+
+    :param max_attempts: requests attempted this many times are left in the dead letter table for inspection
+    :param base_delay: backoff in seconds after the first failed attempt
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: tuple, (number of requests replayed successfully, number of requests that failed again)
+    """
+    start_crawl_run()
+
+    succeeded = failed = 0
+
+    for kind, url, params, context, error, attempts, last_attempt in get_failures(max_attempts):
+        wait = base_delay * 2 ** (attempts - 1) - (datetime.now(timezone.utc) - last_attempt).total_seconds()
+        if wait > 0:
+            time.sleep(wait)
+
+        print(f'retrying {kind} request at {url} after {attempts} attempts ({error})')
+
+        if retry_request(kind, url, params, context, refresh):
+            clear_failure(url, params)
+            succeeded += 1
+        else:
+            failed += 1
+
+    return succeeded, failed
 
 
 def main():
     import db_setup
-    get_seed_users()
-    get_seed_projects()
+    start_crawl_run()
+    start_executor()
+    try:
+        # crawl_users() extends every resource it collects, seed projects included
+        get_seed_users()
+    finally:
+        shutdown_executor()
+
+    # refresh planner statistics, so joins through the relationship views use the integer indexes
+    conn = sqlite3.connect(db_name)
+    conn.execute("ANALYZE;")
+    conn.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config import db_name
+
+# adjacency of the current level and its constants, set in each worker by _init_worker(),
+# and the partition of the current sweep, written by the calling process before each sweep
+_level = dict()
+
+# partition arrays of a level, one value per node: community labels, community degree totals, and community sizes
+_PARTITION_DTYPES = {'labels': np.int64, 'totals': np.float64, 'sizes': np.int64}
+
+
+def create_projection(weighting='count', max_contributors=None):
+    """
+    Builds the weighted user x user collaboration projection of all node contributors in DB as a sparse matrix,
+    via the user x project contributor incidence matrix. Users are interned as integer ids: row i is users[i].
+
+    :param weighting: 'count' to weight each pair of users by number of shared projects, or 'newman' to weight
+    each shared project by 1 / (contributors - 1), so large projects do not dominate the projection
+    :param max_contributors: optional maximum number of contributors, larger projects are left out
+    :return: tuple,
+             (1) scipy.sparse csr matrix of shape (number of users, number of users), symmetric, zero diagonal
+             (2) pandas Index of user GUIDs, one per row
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    cur.execute("SELECT user, node FROM node_contributors;")
+    contributors_df = pd.DataFrame(cur.fetchall(), columns=['user', 'project_guid'])
+
+    conn.close()
+
+    user_ids, users = pd.factorize(contributors_df.user)
+    project_ids, projects = pd.factorize(contributors_df.project_guid)
+    project_sizes = np.bincount(project_ids, minlength=len(projects))
+
+    if weighting == 'newman':
+        project_weights = 1 / np.maximum(project_sizes - 1, 1)
+    else:
+        project_weights = np.ones(len(projects))
+
+    if max_contributors is not None:
+        project_weights[project_sizes > max_contributors] = 0
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(user_ids)), (user_ids, project_ids)),
+        shape=(len(users), len(projects))
+    )
+
+    projection = sparse.csr_matrix(incidence @ sparse.diags(project_weights) @ incidence.T)
+    projection.setdiag(0)
+    projection.eliminate_zeros()
+
+    return projection, pd.Index(users)
+
+
+def modularity(adjacency, labels, resolution=1.0):
+    """
+    Modularity of a partition of a weighted graph, from the weights of edges within communities
+    and the degree totals of communities.
+
+    :param adjacency: symmetric scipy.sparse matrix of edge weights
+    :param labels: numpy array of integer community labels, one per node, from 0 to number of communities - 1
+    :param resolution: resolution parameter, larger values favor smaller communities
+    :return: float, 0 for a graph without edges
+    """
+    adjacency = sparse.csr_matrix(adjacency)
+    two_m = adjacency.data.sum()
+    if two_m == 0:
+        return 0.0
+
+    rows = np.repeat(np.arange(adjacency.shape[0]), np.diff(adjacency.indptr))
+    internal = adjacency.data[labels[rows] == labels[adjacency.indices]].sum()
+    totals = np.bincount(labels, weights=np.asarray(adjacency.sum(axis=1)).ravel())
+
+    return float(internal / two_m - resolution * np.sum((totals / two_m) ** 2))
+
+
+def _init_worker(off_diagonal, degrees, two_m, resolution, partition_names=None):
+    """
+    Store adjacency of the current level in the calling worker, and attach to the shared partition arrays
+    named by partition_names, so tasks only carry the bounds of their chunk.
+    Without names, the partition arrays are allocated in the calling process.
+    """
+    _level['off_diagonal'] = off_diagonal
+    _level['degrees'] = degrees
+    _level['two_m'] = two_m
+    _level['resolution'] = resolution
+
+    _level['blocks'] = []
+    for key, dtype in _PARTITION_DTYPES.items():
+        if partition_names is None:
+            _level[key] = np.zeros(len(degrees), dtype=dtype)
+        else:
+            block = shared_memory.SharedMemory(name=partition_names[key])
+            _level['blocks'].append(block)
+            _level[key] = np.ndarray(len(degrees), dtype=dtype, buffer=block.buf)
+
+
+def _share_partition(num_nodes):
+    """
+    Allocate shared memory for the partition arrays of a level with num_nodes nodes, and use it in this process.
+
+    :return: tuple, (list of SharedMemory blocks to close and unlink after the level, dictionary of block names)
+    """
+    blocks = []
+    names = dict()
+    for key, dtype in _PARTITION_DTYPES.items():
+        block = shared_memory.SharedMemory(create=True, size=max(num_nodes, 1) * np.dtype(dtype).itemsize)
+        blocks.append(block)
+        names[key] = block.name
+        _level[key] = np.ndarray(num_nodes, dtype=dtype, buffer=block.buf)
+
+    return blocks, names
+
+
+def _best_moves(bounds):
+    """
+    Local-move step for a chunk of nodes: for each node in rows bounds[0] to bounds[1], find the neighboring
+    community with the largest modularity gain, given the current partition of all nodes in _level.
+    A singleton only moves to another singleton with a smaller label, so two nodes do not swap in the same sweep.
+
+    :return: tuple of numpy arrays (nodes, target communities) of nodes that improve by moving
+    """
+    start, stop = bounds
+    labels = _level['labels']
+    totals = _level['totals']
+    sizes = _level['sizes']
+    resolution = _level['resolution']
+    two_m = _level['two_m']
+    degrees = _level['degrees'][start:stop]
+    own = labels[start:stop]
+
+    # weight from each node to each neighboring community
+    chunk = _level['off_diagonal'][start:stop].tocoo()
+    to_community = sparse.csr_matrix(
+        (chunk.data, (chunk.row, labels[chunk.col])),
+        shape=(stop - start, len(totals))
+    ).tocoo()
+    rows, communities, weights = to_community.row, to_community.col, to_community.data
+
+    # gain of joining each community after leaving own community, and of staying
+    is_own = communities == own[rows]
+    gains = weights - resolution * degrees[rows] * totals[communities] / two_m
+    own_rows = rows[is_own]
+    gains[is_own] = (
+        weights[is_own] - resolution * degrees[own_rows] * (totals[own[own_rows]] - degrees[own_rows]) / two_m
+    )
+
+    stay = -resolution * degrees * (totals[own] - degrees) / two_m
+    stay[rows[is_own]] = gains[is_own]
+
+    candidates = ~is_own & (gains > stay[rows] + 1e-12)
+    candidates &= ~((sizes[own[rows]] == 1) & (sizes[communities] == 1) & (communities > own[rows]))
+    rows, communities, gains = rows[candidates], communities[candidates], gains[candidates]
+
+    # best candidate of each node
+    order = np.lexsort((-gains, rows))
+    nodes, first = np.unique(rows[order], return_index=True)
+
+    return nodes + start, communities[order][first]
+
+
+def _compact(labels):
+    """
+    Relabel communities as consecutive integers from 0.
+    """
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def _move_nodes(adjacency, labels, map_chunks, num_chunks, resolution, max_sweeps, seed):
+    """
+    Local-move phase on one level: sweep all nodes in parallel chunks, moving each to its best neighboring community,
+    until no sweep improves modularity. If applying all moves of a sweep at once lowers modularity, as moves
+    are decided on the same partition, a random half of them is tried instead.
+
+    :param map_chunks: map function running _best_moves() on chunks, e.g. map() of an executor
+    whose workers share the partition arrays, see _init_worker()
+    :return: numpy array of compact community labels, one per node of this level
+    """
+    rng = np.random.default_rng(seed)
+    num_nodes = adjacency.shape[0]
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+
+    chunk_len = -(-num_nodes // num_chunks)
+    chunks = [(i, min(i + chunk_len, num_nodes)) for i in range(0, num_nodes, chunk_len)]
+
+    labels = _compact(labels)
+    q = modularity(adjacency, labels, resolution)
+
+    for _ in range(max_sweeps):
+        # partition arrays are shared with the workers, labels are compact so there are at most num_nodes communities
+        _level['labels'][:] = labels
+        _level['totals'][:] = np.bincount(labels, weights=degrees, minlength=num_nodes)
+        _level['sizes'][:] = np.bincount(labels, minlength=num_nodes)
+
+        results = list(map_chunks(_best_moves, chunks))
+        nodes = np.concatenate([r[0] for r in results])
+        targets = np.concatenate([r[1] for r in results])
+
+        improved = False
+        while len(nodes):
+            new_labels = labels.copy()
+            new_labels[nodes] = targets
+            new_labels = _compact(new_labels)
+            new_q = modularity(adjacency, new_labels, resolution)
+
+            if new_q > q + 1e-9:
+                labels, q, improved = new_labels, new_q, True
+                break
+
+            keep = rng.random(len(nodes)) < 0.5
+            nodes, targets = nodes[keep], targets[keep]
+
+        if not improved:
+            break
+
+    return labels
+
+
+def detect_communities(adjacency, users, initial=None, resolution=1.0, num_workers=2, max_levels=10,
+                       max_sweeps=20, seed=0):
+    """
+    Louvain community detection on a weighted user x user projection. The local-move phase of each level
+    is split into chunks of nodes evaluated in parallel by worker processes, then communities are aggregated
+    into nodes of the next level, until no level merges communities.
+    Pass the communities of a previous run as initial to warm-start after an incremental crawl, e.g. get_next_level():
+    known users start in their previous community and new users as singletons, so only affected regions move.
+
+    :param adjacency: projection from create_projection()
+    :param users: user index from create_projection()
+    :param initial: optional pandas Series of community labels indexed by user GUID, as returned by this function
+    :param resolution: resolution parameter, larger values favor smaller communities
+    :param num_workers: how many worker processes evaluate local moves, 1 to run in the calling process
+    :param max_levels: maximum number of aggregation levels
+    :param max_sweeps: maximum number of local-move sweeps per level
+    :param seed: seed of random choices, for reproducible partitions
+    :return: tuple,
+             (1) pandas Series of integer community labels indexed by user GUID, largest community labeled 0
+             (2) modularity of the partition
+    """
+    projection = adjacency = sparse.csr_matrix(adjacency, dtype=float)
+    num_users = adjacency.shape[0]
+
+    # without edges every user is a community of their own
+    if adjacency.sum() == 0:
+        return pd.Series(np.arange(num_users), index=users, name='community'), 0.0
+
+    if initial is None:
+        labels = np.arange(num_users)
+    else:
+        # previous community of known users, a new singleton community for each new user
+        labels = pd.Series(initial).reindex(users).factorize()[0]
+        new_users = labels < 0
+        labels[new_users] = labels.max() + 1 + np.arange(new_users.sum())
+
+    # community of each user at the current level
+    membership = np.arange(num_users)
+
+    for level in range(max_levels):
+        off_diagonal = adjacency - sparse.diags(adjacency.diagonal())
+        degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+        initargs = (sparse.csr_matrix(off_diagonal), degrees, adjacency.sum(), resolution)
+
+        if num_workers > 1:
+            blocks, names = _share_partition(adjacency.shape[0])
+            initargs += (names,)
+            try:
+                with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=initargs) as executor:
+                    labels = _move_nodes(
+                        adjacency, labels, executor.map, num_workers * 4, resolution, max_sweeps, seed + level
+                    )
+            finally:
+                for key in _PARTITION_DTYPES:
+                    _level.pop(key)
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+        else:
+            _init_worker(*initargs)
+            labels = _move_nodes(adjacency, labels, map, 1, resolution, max_sweeps, seed + level)
+
+        membership = labels[membership]
+        num_communities = labels.max() + 1
+
+        if num_communities == adjacency.shape[0]:
+            break
+
+        aggregation = sparse.csr_matrix(
+            (np.ones(len(labels)), (np.arange(len(labels)), labels)),
+            shape=(len(labels), num_communities)
+        )
+        adjacency = sparse.csr_matrix(aggregation.T @ adjacency @ aggregation)
+        labels = np.arange(num_communities)
+
+    # label communities by size, largest first
+    sizes = np.bincount(membership)
+    rank = np.empty(len(sizes), dtype=int)
+    rank[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+    membership = rank[membership]
+
+    return pd.Series(membership, index=users, name='community'), modularity(projection, membership, resolution)
@@ -0,0 +1,283 @@
+import os
+import time
+import sqlite3
+from config import db_name
+
+# sqlite limits the number of bound parameters per statement, look up interned ids in chunks of this size
+INTERN_LOOKUP_CHUNK = 500
+
+# relationship tables stored as integer pairs: columns in their original order, and the column rows are grouped by
+LINK_TABLES = {
+    'node_tags': (('id', 'tag'), 'id'),
+    'node_relations': (('parent', 'child'), 'parent'),
+    'node_contributors': (('user', 'node'), 'node'),
+    'registration_contributors': (('user', 'node'), 'node'),
+    'preprint_contributors': (('user', 'node'), 'node')
+}
+
+
+def _vocabulary(column):
+    """
+    Table interning the values of a link column: tags in tags, all GUIDs in guids.
+    """
+    return ('tags', 'tag') if column == 'tag' else ('guids', 'guid')
+
+
+def _create_storage(conn):
+    """
+    Create the guids and tags vocabularies and the integer pair table of each relationship table, if they do not exist.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS guids(
+               id INTEGER PRIMARY KEY,
+               guid TEXT NOT NULL UNIQUE
+               );
+        """
+    )
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tags(
+               id INTEGER PRIMARY KEY,
+               tag TEXT NOT NULL UNIQUE
+               );
+        """
+    )
+
+    for table, (columns, key) in LINK_TABLES.items():
+        other = columns[1] if key == columns[0] else columns[0]
+
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table}_int(
+                   {key} INT NOT NULL,
+                   {other} INT NOT NULL,
+                   PRIMARY KEY({key}, {other})
+                   ) WITHOUT ROWID;
+            """
+        )
+
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_int_{other} ON {table}_int({other}, {key});")
+
+
+def create_link_tables(conn):
+    """
+    Create the integer-keyed storage of the relationship tables, if it does not exist: the guids and tags tables
+    interning each GUID and tag once, a WITHOUT ROWID table of integer pairs per relationship,
+    e.g. node_contributors_int keyed on (node, user) with an index on the other column, and a view under the original table name,
+    e.g. node_contributors(user, node), so queries written against the TEXT GUID layout still work.
+    Inserting into a view interns its values but reports no changed rows, so loaders use insert_links() instead.
+
+    :param conn: open sqlite3 connection to DB
+    :return: None
+    """
+    _create_storage(conn)
+
+    for table, (columns, key) in LINK_TABLES.items():
+        selects = []
+        joins = []
+        interns = []
+        ids = []
+        for column in columns:
+            vocabulary, value = _vocabulary(column)
+            selects.append(f"{column}_v.{value}")
+            joins.append(f"JOIN {vocabulary} {column}_v ON l.{column}={column}_v.id")
+            interns.append(f"INSERT OR IGNORE INTO {vocabulary}({value}) VALUES (new.{column});")
+            ids.append(f"(SELECT id FROM {vocabulary} WHERE {value}=new.{column})")
+
+        conn.execute(
+            f"""
+            CREATE VIEW IF NOT EXISTS {table}({', '.join(columns)}) AS
+            SELECT {', '.join(selects)}
+              FROM {table}_int l
+                   {' '.join(joins)};
+            """
+        )
+
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_insert INSTEAD OF INSERT ON {table} BEGIN
+                   {' '.join(interns)}
+                   INSERT OR IGNORE INTO {table}_int({', '.join(columns)}) VALUES ({', '.join(ids)});
+            END;
+            """
+        )
+
+
+def migrate_link_tables(conn):
+    """
+    Migrate relationship tables of the TEXT GUID layout, if any, into the integer-keyed storage:
+    intern their values, copy their rows as integer pairs, and drop them, so create_link_tables()
+    can create views in their place. Rows with a missing value are not copied. Commits.
+
+    :param conn: open sqlite3 connection to DB
+    :return: list of names of migrated tables
+    """
+    migrated = []
+
+    for table, (columns, key) in LINK_TABLES.items():
+        is_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (table,)
+        ).fetchone()
+
+        if not is_table:
+            continue
+
+        print(f'migrating {table} to integer keys')
+        _create_storage(conn)
+
+        for column in columns:
+            vocabulary, value = _vocabulary(column)
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO {vocabulary}({value})
+                SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL;
+                """
+            )
+
+        a, b = columns
+        vocabulary_a, value_a = _vocabulary(a)
+        vocabulary_b, value_b = _vocabulary(b)
+        conn.execute(
+            f"""
+            INSERT OR IGNORE INTO {table}_int({a}, {b})
+            SELECT va.id,
+                   vb.id
+              FROM {table} t
+              JOIN {vocabulary_a} va ON t.{a}=va.{value_a}
+              JOIN {vocabulary_b} vb ON t.{b}=vb.{value_b};
+            """
+        )
+
+        # full-text index over the old table, replaced by an index over the tags vocabulary in db_setup.py
+        conn.execute(f"DROP TABLE IF EXISTS {table}_fts;")
+        conn.execute(f"DROP TABLE {table};")
+
+        migrated.append(table)
+
+    conn.commit()
+
+    return migrated
+
+
+def _intern(conn, column, values):
+    """
+    Intern values of a link column, see _vocabulary(). Does not commit.
+
+    :return: dictionary of value to integer id
+    """
+    vocabulary, value = _vocabulary(column)
+    values = list(set(values))
+
+    conn.executemany(f"INSERT OR IGNORE INTO {vocabulary}({value}) VALUES (?)", ((v,) for v in values))
+
+    ids = dict()
+    for i in range(0, len(values), INTERN_LOOKUP_CHUNK):
+        chunk = values[i:i + INTERN_LOOKUP_CHUNK]
+        cur = conn.execute(
+            f"SELECT {value}, id FROM {vocabulary} WHERE {value} IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        ids.update(cur.fetchall())
+
+    return ids
+
+
+def insert_links(conn, table, rows):
+    """
+    Insert relationship rows given as GUIDs (and tags) into the integer-keyed storage of a relationship table,
+    interning new values, as INSERT OR IGNORE into the table of the TEXT GUID layout would. Does not commit.
+
+    :param conn: open sqlite3 connection to DB
+    :param table: name of relationship table, one of LINK_TABLES, e.g. 'node_contributors'
+    :param rows: list of tuples of GUIDs (and tags), in the column order of the table, e.g. (user, node)
+    :return: int, number of rows newly inserted
+    """
+    columns = LINK_TABLES[table][0]
+    ids = [_intern(conn, column, [r[i] for r in rows]) for i, column in enumerate(columns)]
+
+    cur = conn.executemany(
+        f"INSERT OR IGNORE INTO {table}_int({', '.join(columns)}) VALUES (?, ?)",
+        ((ids[0][r[0]], ids[1][r[1]]) for r in rows)
+    )
+
+    return cur.rowcount
+
+
+def measure_storage(path=db_name, repeat=3):
+    """
+    Measure size of a DB file and speed of a typical join on it: counting collaborations of COS staff
+    with external users, the self-join of node_contributors on node used by network_functions.create_network().
+    Works on both the TEXT GUID layout and the integer-keyed layout; on the latter the join is timed
+    through the compatibility view and directly on integer keys.
+
+    :param path: file name of DB, defaults to db_name from config
+    :param repeat: number of runs per query, the fastest is reported
+    :return: dictionary with keys 'file_bytes', 'link_bytes' (bytes of relationship tables and their indexes,
+             None if sqlite lacks dbstat), 'view_join_seconds', 'int_join_seconds' (None on the TEXT GUID layout)
+    """
+    conn = sqlite3.connect(path)
+
+    is_compact = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='node_contributors_int'"
+    ).fetchone() is not None
+
+    try:
+        link_bytes = conn.execute(
+            """
+            SELECT SUM(pgsize)
+              FROM dbstat
+             WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name LIKE '%contributors%' OR
+                                                                tbl_name LIKE 'node_relations%' OR
+                                                                tbl_name LIKE 'node_tags%' OR
+                                                                tbl_name IN ('guids', 'tags'));
+            """
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        link_bytes = None
+
+    def best_time(query):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(query).fetchall()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    view_join = best_time(
+        """
+        SELECT s.user,
+               COUNT(*)
+          FROM node_contributors s
+          JOIN cos_staff cos ON s.user=cos.id
+          JOIN node_contributors e ON s.node=e.node
+         WHERE e.user NOT IN (SELECT id FROM cos_staff)
+         GROUP BY s.user;
+        """
+    )
+
+    int_join = None
+    if is_compact:
+        int_join = best_time(
+            """
+            SELECT s.user,
+                   COUNT(*)
+              FROM node_contributors_int s
+              JOIN guids g ON s.user=g.id
+              JOIN cos_staff cos ON g.guid=cos.id
+              JOIN node_contributors_int e ON s.node=e.node
+             WHERE e.user NOT IN (SELECT g.id FROM cos_staff cos JOIN guids g ON cos.id=g.guid)
+             GROUP BY s.user;
+            """
+        )
+
+    conn.close()
+
+    return {
+        'file_bytes': os.path.getsize(path),
+        'link_bytes': link_bytes,
+        'view_join_seconds': view_join,
+        'int_join_seconds': int_join
+    }
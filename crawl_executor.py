@@ -0,0 +1,98 @@
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config import headers
+from seen_users import create_seen_users, init_seen_users
+
+# long-lived executor shared by all collection stages of a crawl, see start_executor()
+_executor = None
+
+# one HTTP session per worker thread (and so per worker process), see get_session()
+_local = threading.local()
+
+
+def count_request():
+    """
+    Count a request attempted by the calling worker, see get_request_count(). Called before each request is sent,
+    so requests that fail without a response (e.g. connection errors) count too.
+
+    :return: None
+    """
+    _local.num_requests = getattr(_local, 'num_requests', 0) + 1
+
+
+def get_request_count():
+    """
+    Get number of requests attempted so far by the calling worker, whether or not they succeeded.
+
+    :return: int, number of requests
+    """
+    return getattr(_local, 'num_requests', 0)
+
+
+def get_session():
+    """
+    Get persistent HTTP session of the calling worker, creating it on first use.
+    Reusing the session keeps connections to the OSF API alive across requests.
+
+    :return: requests.Session with OSF authentication headers
+    """
+    session = getattr(_local, 'session', None)
+
+    if session is None:
+        session = requests.Session()
+        session.headers.update(headers)
+        _local.session = session
+
+    return session
+
+
+def start_executor(num_workers=2, use_threads=True):
+    """
+    Create the executor shared by all collection stages of a crawl, replacing any running executor.
+    Requests are I/O-bound, so threads are used by default; processes are available with use_threads=False.
+    Workers are attached to a shared seen-user cache created for this crawl.
+
+    :param num_workers: how many worker threads or processes to run
+    :param use_threads: if True, run workers as threads, otherwise as processes
+    :return: the new executor
+    """
+    global _executor
+
+    shutdown_executor()
+
+    # create_seen_users() also attaches the filter to this process, which thread workers share
+    seen_users = create_seen_users()
+
+    if use_threads:
+        _executor = ThreadPoolExecutor(num_workers)
+    else:
+        _executor = ProcessPoolExecutor(num_workers, initializer=init_seen_users, initargs=seen_users)
+
+    return _executor
+
+
+def get_executor(num_workers=2):
+    """
+    Get the executor of the current crawl, starting a thread-based one if none is running.
+
+    :param num_workers: how many workers to run if a new executor must be started
+    :return: the running executor
+    """
+    if _executor is None:
+        start_executor(num_workers)
+
+    return _executor
+
+
+def shutdown_executor():
+    """
+    Wait for pending work and shut down the executor of the current crawl, if any.
+
+    :return: None
+    """
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
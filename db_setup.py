@@ -1,5 +1,6 @@
 import sqlite3
 from config import db_name
+from compact_schema import migrate_link_tables, create_link_tables
 
 conn = sqlite3.connect(db_name)
 
@@ -73,74 +74,164 @@ conn.execute(
 
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS node_tags(
-           id TEXT,
-           tag TEXT,
-           UNIQUE(id, tag)
+    CREATE TABLE IF NOT EXISTS registrations(
+           id TEXT PRIMARY KEY,
+           title TEXT,
+           date_registered TEXT
            );
     """
 )
 
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS node_relations(
-           parent TEXT,
-           child TEXT,
-           UNIQUE(parent, child)
+    CREATE TABLE IF NOT EXISTS preprints(
+           id TEXT PRIMARY KEY,
+           title TEXT,
+           date_published TEXT
            );
     """
 )
 
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS node_contributors(
-           user TEXT,
-           node TEXT,
-           UNIQUE(user, node)
+    CREATE TABLE IF NOT EXISTS crawl_runs(
+           id INTEGER PRIMARY KEY,
+           started TEXT NOT NULL
            );
     """
 )
 
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS registrations(
-           id TEXT PRIMARY KEY,
-           title TEXT,
-           date_registered TEXT
-           );
+    CREATE TABLE IF NOT EXISTS content_hashes(
+           entity TEXT NOT NULL,
+           id TEXT NOT NULL,
+           hash TEXT NOT NULL,
+           PRIMARY KEY(entity, id)
+           ) WITHOUT ROWID;
     """
 )
 
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS registration_contributors(
-           user TEXT,
-           node TEXT,
-           UNIQUE(user, node)
+    CREATE TABLE IF NOT EXISTS changelog(
+           run INT NOT NULL,
+           entity TEXT NOT NULL,
+           id TEXT NOT NULL,
+           action TEXT NOT NULL,
+           num_rows INT NOT NULL
            );
     """
 )
 
+conn.execute("CREATE INDEX IF NOT EXISTS changelog_run ON changelog(run);")
+
+# name index of an older layout with one blocking key row per first and last name token,
+# dropped to be rebuilt by name_matching.build_name_index() with one selective key per user
+if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_name_blocks'").fetchone():
+    conn.execute("DROP TABLE user_name_blocks;")
+    conn.execute("DROP TABLE IF EXISTS user_names;")
+
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS preprints(
+    CREATE TABLE IF NOT EXISTS user_names(
            id TEXT PRIMARY KEY,
-           title TEXT,
-           date_published TEXT
+           normalized TEXT NOT NULL,
+           block TEXT
            );
     """
 )
 
+conn.execute("CREATE INDEX IF NOT EXISTS user_names_normalized ON user_names(normalized);")
+conn.execute("CREATE INDEX IF NOT EXISTS user_names_block ON user_names(block, normalized);")
+
 conn.execute(
     """
-    CREATE TABLE IF NOT EXISTS preprint_contributors(
-           user TEXT,
-           node TEXT,
-           UNIQUE(user, node)
+    CREATE TABLE IF NOT EXISTS failed_requests(
+           url TEXT NOT NULL,
+           params TEXT NOT NULL,
+           kind TEXT NOT NULL,
+           context TEXT NOT NULL,
+           error TEXT NOT NULL,
+           attempts INT NOT NULL,
+           last_attempt TEXT NOT NULL,
+           permanent INT NOT NULL DEFAULT 0,
+           PRIMARY KEY(url, params)
            );
     """
 )
 
+# dead letter tables created before failures were classified, earlier failures are treated as transient
+if 'permanent' not in [c[1] for c in conn.execute("PRAGMA table_info(failed_requests);").fetchall()]:
+    conn.execute("ALTER TABLE failed_requests ADD COLUMN permanent INT NOT NULL DEFAULT 0;")
+
+conn.execute(
+    """
+    CREATE TABLE IF NOT EXISTS reach_sketches(
+           staff TEXT NOT NULL,
+           bucket TEXT NOT NULL,
+           sketch BLOB NOT NULL,
+           PRIMARY KEY(staff, bucket)
+           ) WITHOUT ROWID;
+    """
+)
+
+# relationship tables (tags, child nodes, contributors) are stored as interned integer pairs behind views,
+# databases of the TEXT GUID layout are migrated first
+migrated = migrate_link_tables(conn)
+create_link_tables(conn)
+
+if migrated:
+    # planner statistics let joins through the views use the integer indexes
+    conn.execute("ANALYZE;")
+    conn.execute("VACUUM;")
+
+# full-text indexes over titles and tags, kept in sync with their content tables by triggers
+for table, column in [('nodes', 'title'), ('registrations', 'title'), ('preprints', 'title'), ('tags', 'tag')]:
+    fts_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+        (f'{table}_fts',)
+    ).fetchone()
+
+    conn.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+               {column},
+               content='{table}',
+               content_rowid='rowid'
+               );
+        """
+    )
+
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+               INSERT INTO {table}_fts(rowid, {column}) VALUES (new.rowid, new.{column});
+        END;
+        """
+    )
+
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+               INSERT INTO {table}_fts({table}_fts, rowid, {column}) VALUES ('delete', old.rowid, old.{column});
+        END;
+        """
+    )
+
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {column} ON {table} BEGIN
+               INSERT INTO {table}_fts({table}_fts, rowid, {column}) VALUES ('delete', old.rowid, old.{column});
+               INSERT INTO {table}_fts(rowid, {column}) VALUES (new.rowid, new.{column});
+        END;
+        """
+    )
+
+    # index rows loaded before the full-text index existed
+    if not fts_exists:
+        conn.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild');")
+
 conn.commit()
 conn.close()
 
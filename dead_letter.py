@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import requests
+from datetime import datetime, timezone
+from config import db_name
+from crawl_executor import get_session, count_request
+
+
+def is_permanent(status_code):
+    """
+    Classify a failed HTTP response: client errors other than 429 (too many requests), e.g. 403, 404, or 410
+    for private or deleted nodes, fail again on every replay. Server errors and 429 are transient.
+
+    :param status_code: HTTP status code of a failed response
+    :return: bool, True if the failure is permanent
+    """
+    return 400 <= status_code < 500 and status_code != 429
+
+
+def record_failure(kind, url, params, context, error, permanent=False):
+    """
+    Persist a failed request in the dead letter table so it can be replayed later without re-crawling.
+    Repeated failures of the same request increment its attempt count.
+    Permanent failures are kept so the crawl can leave their GUIDs out, but are not replayed.
+
+    :param kind: type of request, determines how it is replayed, e.g. 'project' or 'node_contributors_page'
+    :param url: exact URL requested, including pagination cursor if any
+    :param params: query parameters passed with the request, or None
+    :param context: dictionary of JSON-serializable values needed to process the response, e.g. the parent GUID
+    :param error: description of error, e.g. HTTP status or exception class
+    :param permanent: if True, the request is not replayed, see is_permanent()
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute(
+        """
+        INSERT INTO failed_requests(url, params, kind, context, error, attempts, last_attempt, permanent)
+        VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT(url, params) DO UPDATE
+           SET error=excluded.error, attempts=attempts + 1, last_attempt=excluded.last_attempt,
+               permanent=excluded.permanent
+        """,
+        (
+            url,
+            json.dumps(params, sort_keys=True),
+            kind,
+            json.dumps(context, sort_keys=True),
+            error,
+            datetime.now(timezone.utc).isoformat(),
+            int(permanent)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def record_missing(kind, url, guids, returned):
+    """
+    Record GUIDs requested with a filter[id] list request but missing from its response, e.g. deleted or private nodes,
+    as permanent failures of their single requests, so they are left out of crawls without being requested again.
+
+    :param kind: type of the single request, 'project' or 'user'
+    :param url: list endpoint the GUID is appended to for a single request, e.g. base_url + '/nodes/'
+    :param guids: GUIDs requested
+    :param returned: GUIDs in the response
+    :return: list of missing GUIDs, in request order
+    """
+    returned = set(returned)
+    missing = [guid for guid in guids if guid not in returned]
+
+    for guid in missing:
+        record_failure(kind, url + guid, None, {'guid': guid}, 'missing from filter[id] response', permanent=True)
+
+    return missing
+
+
+def clear_failure(url, params):
+    """
+    Remove a request from the dead letter table, e.g. after it was replayed successfully.
+
+    :param url: URL of failed request as recorded
+    :param params: query parameters of failed request as recorded, or None
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute(
+        "DELETE FROM failed_requests WHERE url = ? AND params = ?",
+        (url, json.dumps(params, sort_keys=True))
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_failures(max_attempts=None, include_permanent=False):
+    """
+    Gather failed requests from the dead letter table, oldest attempts first.
+
+    :param max_attempts: if provided, only gather requests attempted fewer times than this
+    :param include_permanent: if True, also gather permanent failures, which are left out of replays by default
+    :return: list of tuples of form (kind, url, params, context, error, attempts, last_attempt),
+    where params and context are decoded from JSON and last_attempt is a datetime
+    """
+    query = "SELECT kind, url, params, context, error, attempts, last_attempt FROM failed_requests WHERE 1=1"
+    params = []
+
+    if max_attempts is not None:
+        query += " AND attempts < ?"
+        params.append(max_attempts)
+
+    if not include_permanent:
+        query += " AND permanent = 0"
+
+    conn = sqlite3.connect(db_name)
+    failures = conn.execute(query + " ORDER BY last_attempt;", params).fetchall()
+    conn.close()
+
+    return [
+        (kind, url, json.loads(p), json.loads(c), error, attempts, datetime.fromisoformat(last))
+        for kind, url, p, c, error, attempts, last in failures
+    ]
+
+
+def get_json(url, kind, context, params=None):
+    """
+    Request JSON from OSF with the session of the calling worker, counting the attempt (see get_request_count()).
+    Prints errors to console if request fails and records failed requests in the dead letter table,
+    client errors as permanent failures (see is_permanent()) and connection errors as transient ones.
+
+    :param url: URL to request
+    :param kind: type of request, see record_failure()
+    :param context: dictionary of values needed to replay the request, see record_failure()
+    :param params: additional parameters to pass to request
+    :return: response json if response is successful, else empty dictionary
+    """
+    count_request()
+
+    try:
+        response = get_session().get(url, params=params)
+    except requests.RequestException as e:
+        print(f'{kind} request failed at {url}: {type(e).__name__} - {e}')
+        record_failure(kind, url, params, context, type(e).__name__)
+        return {}
+
+    if not response.ok:
+        print(f'{kind} request failed at {response.url}: {response.status_code} - {response.reason}')
+        error = f'HTTP {response.status_code} {response.reason}'
+        record_failure(kind, url, params, context, error, is_permanent(response.status_code))
+        return {}
+
+    return response.json()
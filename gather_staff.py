@@ -1,18 +1,23 @@
 import sqlite3
 from config import db_name, seed_project, staff_insert, cos_alumni
-from user_functions import map_reduce_get_user_resources, load_user_resources
-from collect_data import get_seed_projects
+from collect_data import crawl_users
+from change_tracking import start_crawl_run
+from crawl_executor import start_executor, shutdown_executor
+from name_matching import match_names
+from reach_sketches import build_reach_sketches
 
 
-def main():
+def main(min_score=0.8):
     """
     Using info gathered from staff and alumni pages on COS website,
     try to verify that we've identified as many current and former staff as easily possible.
     Complete gaps in COS staff data by selecting staff missing from the COS OSF page and collecting their project data.
+    Finally rebuild reach sketches (see reach_sketches.py) for the complete staff list.
     
+    :param min_score: minimum name similarity score for a user to be identified as an alumnus, see name_matching
     :return: None
     """
-    find_alumni = [(name,) for name in cos_alumni]
+    start_crawl_run()
 
     conn = sqlite3.connect(db_name)
     cur = conn.cursor()
@@ -23,18 +28,14 @@ def main():
     )
     conn.commit()
 
-    alumni = []
-    for name in find_alumni:
-        cur.execute(
-            "SELECT * FROM users WHERE full_name = ?",
-            name
-        )
-        alumni.append(cur.fetchall())
+    # best candidate per alumni name, favoring users who list COS as an employer
+    alumni = match_names(cos_alumni, min_score=min_score, limit=1, institution='Center for Open Science')
 
-    alumni_insert = [(a[0][0], 0) for a in alumni if len(a)]
+    alumni_insert = [(a[0][0], 0) for a in alumni.values() if len(a)]
 
+    # fuzzy matches must not demote known current staff
     cur.executemany(
-        "INSERT OR REPLACE INTO cos_staff(id, current) VAlUES (?, ?)",
+        "INSERT OR IGNORE INTO cos_staff(id, current) VAlUES (?, ?)",
         alumni_insert
     )
     conn.commit()
@@ -54,13 +55,16 @@ def main():
 
     missing = [m[0] for m in missing]
 
-    for ix, guid in enumerate(missing):
-        print(f'fetching nodes for user {ix} - {guid}')
-        nodes = map_reduce_get_user_resources(guid, 'nodes')
-        load_user_resources(nodes, 'nodes')
+    start_executor()
+    try:
+        # extends every resource collected for the missing staff
+        crawl_users(missing)
+    finally:
+        shutdown_executor()
 
-    # gather node guids from newly collected user nodes to enhance with additional data
-    get_seed_projects()
+    # sketches are only updated for staff already in cos_staff when contributors are loaded,
+    # rebuild them now that current staff and alumni are known
+    build_reach_sketches()
 
 
 if __name__ == '__main__':
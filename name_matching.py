@@ -0,0 +1,209 @@
+import re
+import sqlite3
+import unicodedata
+from config import db_name
+
+# honorifics and degrees dropped from names before matching
+NAME_STOPWORDS = {'dr', 'prof', 'mr', 'mrs', 'ms', 'phd', 'md', 'jr', 'sr'}
+
+
+def normalize_name(name):
+    """
+    Normalize a person's name for matching: strip accents, punctuation, honorifics, case, and extra whitespace.
+
+    :param name: full name as entered on OSF or elsewhere
+    :return: str, normalized name of space-separated lowercase tokens
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    tokens = re.sub(r'[^\w]+', ' ', name).split()
+
+    return ' '.join(t for t in tokens if t not in NAME_STOPWORDS)
+
+
+def name_block(normalized):
+    """
+    Blocking key of a normalized name in the name index: last name token and first initial, e.g. 'smith j'
+    for 'john a smith'. Only names sharing a key are compared. A single-token name is its own key.
+
+    :param normalized: name from normalize_name()
+    :return: str, blocking key, None for an empty name
+    """
+    tokens = normalized.split()
+
+    if not tokens:
+        return None
+
+    return f'{tokens[-1]} {tokens[0][0]}' if len(tokens) > 1 else tokens[0]
+
+
+def name_blocks(normalized):
+    """
+    Blocking keys to look up for a query name: its own key and the key of its tokens in reverse order,
+    so names entered last name first are still compared.
+
+    :param normalized: name from normalize_name()
+    :return: set of blocking keys
+    """
+    tokens = normalized.split()
+
+    return {name_block(' '.join(tokens)), name_block(' '.join(reversed(tokens)))} if tokens else set()
+
+
+def name_trigrams(normalized):
+    """
+    Character trigrams of a normalized name, padded to weight the start and end of the name.
+
+    :param normalized: name from normalize_name()
+    :return: set of trigrams
+    """
+    padded = f'  {normalized} '
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _drop_middle_initials(tokens):
+    """
+    Drop one-letter tokens between the first and last token of a name.
+    """
+    return tokens[:1] + [t for t in tokens[1:-1] if len(t) > 1] + tokens[-1:] if len(tokens) > 1 else tokens
+
+
+def score_names(query, candidate):
+    """
+    Similarity of two normalized names: 1 for identical names, 0.95 for the same tokens in a different order,
+    0.9 for the same full first name and last name once middle initials are ignored,
+    otherwise Jaccard similarity of their trigrams.
+
+    :param query: name from normalize_name()
+    :param candidate: name from normalize_name()
+    :return: float between 0 and 1
+    """
+    if query == candidate:
+        return 1.0
+
+    if sorted(query.split()) == sorted(candidate.split()):
+        return 0.95
+
+    # first and last tokens are always compared, a first initial or a bare last name is not enough
+    query_core = _drop_middle_initials(query.split())
+    if len(query_core) > 1 and len(query_core[0]) > 1 and query_core == _drop_middle_initials(candidate.split()):
+        return 0.9
+
+    a = name_trigrams(query)
+    b = name_trigrams(candidate)
+
+    return len(a & b) / len(a | b)
+
+
+def build_name_index(rebuild=False):
+    """
+    Add normalized names and blocking keys of users not yet indexed to the user_names table.
+
+    :param rebuild: if True, re-index all users, e.g. after profile names were updated
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+
+    if rebuild:
+        conn.execute("DELETE FROM user_names;")
+
+    cur = conn.execute("SELECT id, full_name FROM users WHERE id NOT IN (SELECT id FROM user_names);")
+
+    names = []
+    for guid, full_name in cur.fetchall():
+        normalized = normalize_name(full_name)
+        names.append((guid, normalized, name_block(normalized)))
+
+    conn.executemany("INSERT OR REPLACE INTO user_names(id, normalized, block) VALUES (?, ?, ?)", names)
+    conn.commit()
+    conn.close()
+
+
+def match_names(names, min_score=0.5, limit=5, institution=None):
+    """
+    Match a batch of names against all users in DB. Candidate names are gathered for all names at once
+    by joining their blocking keys against the name index, and each distinct candidate name is scored once
+    with score_names() as it is read. Only users with a name scoring high enough are looked up.
+
+    :param names: iterable of full names to identify
+    :param min_score: minimum score of returned candidates
+    :param limit: maximum number of candidates returned per name
+    :param institution: optional institution name, candidates with a job there get a 0.1 bonus (capped at 1)
+    :return: dictionary of name to list of candidates as tuples (guid, full_name, score), best first
+    """
+    build_name_index()
+
+    names = list(dict.fromkeys(names))
+    queries = [normalize_name(name) for name in names]
+
+    conn = sqlite3.connect(db_name)
+    conn.execute("CREATE TEMP TABLE query_blocks(qid INT, block TEXT);")
+    conn.executemany(
+        "INSERT INTO query_blocks(qid, block) VALUES (?, ?)",
+        [(qid, block) for qid, query in enumerate(queries) for block in name_blocks(query)]
+    )
+
+    # affiliated candidates get a bonus, so their names may score up to 0.1 below min_score
+    name_min_score = min_score if institution is None else min_score - 0.1
+
+    cur = conn.execute(
+        """
+        SELECT DISTINCT q.qid,
+               n.normalized
+          FROM query_blocks q
+          JOIN user_names n ON q.block=n.block;
+        """
+    )
+    scored = []
+    for qid, normalized in cur:
+        score = score_names(queries[qid], normalized)
+        if score >= name_min_score:
+            scored.append((qid, normalized, score))
+
+    conn.execute("CREATE TEMP TABLE name_scores(qid INT, normalized TEXT, score REAL);")
+    conn.executemany("INSERT INTO name_scores(qid, normalized, score) VALUES (?, ?, ?)", scored)
+
+    cur = conn.execute(
+        """
+        SELECT s.qid,
+               u.id,
+               u.full_name,
+               s.score
+          FROM name_scores s
+          JOIN query_blocks q ON s.qid=q.qid
+          JOIN user_names n ON q.block=n.block AND s.normalized=n.normalized
+          JOIN users u ON n.id=u.id;
+        """
+    )
+    candidates = cur.fetchall()
+
+    affiliated = set()
+    if institution is not None:
+        cur = conn.execute(
+            """
+            SELECT DISTINCT j.id
+              FROM name_scores s
+              JOIN query_blocks q ON s.qid=q.qid
+              JOIN user_names n ON q.block=n.block AND s.normalized=n.normalized
+              JOIN jobs j ON n.id=j.id
+             WHERE j.institution LIKE ?;
+            """,
+            (f'%{institution}%',)
+        )
+        affiliated = {a[0] for a in cur.fetchall()}
+
+    conn.close()
+
+    matches = {name: [] for name in names}
+    for qid, guid, full_name, score in candidates:
+        if guid in affiliated:
+            score = min(1.0, score + 0.1)
+        if score >= min_score:
+            matches[names[qid]].append((guid, full_name, score))
+
+    for name, ranked in matches.items():
+        ranked.sort(key=lambda x: x[2], reverse=True)
+        matches[name] = ranked[:limit]
+
+    return matches
@@ -1,13 +1,39 @@
 import sqlite3
-import itertools
 import pandas as pd
 from config import db_name
 
 
-def create_network():
+def _network_filter(cur, projects, max_contributors):
+    """
+    SQL condition restricting a self-join of node_contributors_int aliased s to given projects, and to projects
+    with at most max_contributors contributors (sizes.num_contributors), creating a temp table of projects as needed.
+
+    :return: tuple, (SQL condition, list of parameters)
+    """
+    conditions = ["1=1"]
+    params = []
+
+    if projects is not None:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS network_projects(id TEXT PRIMARY KEY);")
+        cur.execute("DELETE FROM network_projects;")
+        cur.executemany("INSERT OR IGNORE INTO network_projects(id) VALUES (?)", ((p,) for p in projects))
+        conditions.append("s.node IN (SELECT g.id FROM network_projects p JOIN guids g ON p.id=g.guid)")
+
+    if max_contributors is not None:
+        conditions.append("sizes.num_contributors <= ?")
+        params.append(max_contributors)
+
+    return ' AND '.join(conditions), params
+
+
+def create_network(projects=None, max_contributors=None):
     """
     Gathers all users and their co-collaborations from DB.
+    Edges are the staff x non-staff cross product of each project's contributors, joined in DB,
+    so runtime and memory scale with the number of edges rather than with pairs of contributors.
     
+    :param projects: optional iterable of node GUIDs, if provided only collaborations on these projects are gathered
+    :param max_contributors: optional maximum number of contributors, collaborations on larger projects are left out
     :return: tuple, three dataframes: 
              (1) users (network nodes) with columns: 'guid', 'full_name', 'is_cos' (None if non-COS, 0 if former and 1 if current)
              (2) edges with columns: 'internal', 'external', 'project_guid'
@@ -27,39 +53,215 @@ def create_network():
     )
     users = cur.fetchall()
 
+    # staff x non-staff contributors of each project, joined on integer keys (see compact_schema.py)
+    condition, params = _network_filter(cur, projects, max_contributors)
     cur.execute(
-        """
-        SELECT node, user
-          FROM node_contributors
-         ORDER BY node, user;
-        """
+        f"""
+        WITH staff AS (SELECT g.id FROM cos_staff cos JOIN guids g ON cos.id=g.guid),
+             sizes AS (SELECT node, COUNT(*) AS num_contributors FROM node_contributors_int GROUP BY node)
+        SELECT gi.guid,
+               ge.guid,
+               gn.guid
+          FROM node_contributors_int s
+          JOIN sizes ON s.node=sizes.node
+          JOIN node_contributors_int e ON s.node=e.node
+          JOIN guids gi ON s.user=gi.id
+          JOIN guids ge ON e.user=ge.id
+          JOIN guids gn ON s.node=gn.id
+         WHERE s.user IN (SELECT id FROM staff) AND
+               e.user NOT IN (SELECT id FROM staff) AND
+               {condition}
+         ORDER BY gn.guid, gi.guid, ge.guid;
+        """,
+        params
     )
-    contributors = cur.fetchall()
+    edges = cur.fetchall()
 
     conn.close()
 
     users_df = pd.DataFrame(users, columns=['guid', 'full_name', 'is_cos'])
-    cos_staff = users_df[users_df.is_cos.notna()].guid.values
+    edges_df = pd.DataFrame(edges, columns=['internal', 'external', 'project_guid'])
 
-    contributor_relations = dict()
+    return users_df, edges_df
 
-    for c in contributors:
-        if c[0] in contributor_relations:
-            contributor_relations[c[0]].append(c[1])
-        else:
-            contributor_relations[c[0]] = [c[1]]
 
-    edges = []
+def count_collaborations(projects=None, max_contributors=None):
+    """
+    Counts collaborations of each staff member and external collaborator directly in DB, without gathering
+    per-project edges: number of shared projects, and a weight discounting large projects, where each shared
+    project adds 1 / (contributors - 1) as in Newman's collaboration networks.
 
-    for node, users in contributor_relations.items():
-        for edge in itertools.combinations(users, 2):
-            a = edge[0]
-            b = edge[1]
-            if a in cos_staff and b not in cos_staff:
-                edges.append((a, b, node))
-            elif a not in cos_staff and b in cos_staff:
-                edges.append((b, a, node))
+    :param projects: optional iterable of node GUIDs, if provided only collaborations on these projects are counted
+    :param max_contributors: optional maximum number of contributors, larger projects are left out
+    :return: dataframe with columns: 'internal', 'external', 'num_projects', 'weight', one row per pair
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
 
-    edges_df = pd.DataFrame(edges, columns=['internal', 'external', 'project_guid'])
+    condition, params = _network_filter(cur, projects, max_contributors)
+    cur.execute(
+        f"""
+        WITH staff AS (SELECT g.id FROM cos_staff cos JOIN guids g ON cos.id=g.guid),
+             sizes AS (SELECT node, COUNT(*) AS num_contributors FROM node_contributors_int GROUP BY node),
+             pairs AS (SELECT s.user AS internal,
+                              e.user AS external,
+                              COUNT(*) AS num_projects,
+                              SUM(1.0 / (sizes.num_contributors - 1)) AS weight
+                         FROM node_contributors_int s
+                         JOIN sizes ON s.node=sizes.node
+                         JOIN node_contributors_int e ON s.node=e.node
+                        WHERE s.user IN (SELECT id FROM staff) AND
+                              e.user NOT IN (SELECT id FROM staff) AND
+                              {condition}
+                        GROUP BY s.user, e.user)
+        SELECT gi.guid,
+               ge.guid,
+               pairs.num_projects,
+               pairs.weight
+          FROM pairs
+          JOIN guids gi ON pairs.internal=gi.id
+          JOIN guids ge ON pairs.external=ge.id
+         ORDER BY gi.guid, ge.guid;
+        """,
+        params
+    )
+    counts = cur.fetchall()
 
-    return users_df, edges_df
+    conn.close()
+
+    return pd.DataFrame(counts, columns=['internal', 'external', 'num_projects', 'weight'])
+
+
+def create_temporal_network(freq='Y', edges_df=None):
+    """
+    Describes growth of the collaboration network over time, using project creation dates.
+    Edges are sorted by project creation date once; the first edge of each staff-external pair and of each external
+    collaborator marks when that tie or collaborator entered the network, and cumulative metrics are prefix sums
+    of those per-period counts.
+
+    :param freq: pandas period frequency of snapshots, e.g. 'Y' for yearly or 'M' for monthly
+    :param edges_df: optional edges from create_network(), gathered from DB if not provided
+    :return: tuple, two dataframes, empty if no edge has a dated project:
+             (1) per staff member and period, indexed by 'internal', 'period', with columns:
+                 'new_ties' (external collaborators first shared a project with in period),
+                 'degree' (distinct external collaborators up to and including period)
+             (2) per period, indexed by 'period', with columns:
+                 'collaborations' (edges on projects created in period), 'new_ties', 'ties' (cumulative),
+                 'new_external', 'external' (distinct external collaborators of any staff, cumulative)
+    """
+    if edges_df is None:
+        _, edges_df = create_network()
+
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    cur.execute("SELECT id, date_created FROM nodes;")
+    dates = pd.DataFrame(cur.fetchall(), columns=['project_guid', 'date_created'])
+
+    conn.close()
+
+    edges = edges_df.merge(dates, on='project_guid')
+    edges['date_created'] = pd.to_datetime(edges.date_created, utc=True, format='ISO8601', errors='coerce')
+    edges = edges.dropna(subset=['date_created']).sort_values('date_created', kind='stable')
+    edges['period'] = edges.date_created.dt.tz_localize(None).dt.to_period(freq)
+
+    # no dated edges, e.g. an empty DB or a project selection matching nothing
+    if edges.empty:
+        no_periods = pd.PeriodIndex([], freq=freq, name='period')
+        staff_metrics = pd.DataFrame(
+            {'new_ties': [], 'degree': []},
+            index=pd.MultiIndex.from_arrays([pd.Index([], dtype=object), no_periods], names=['internal', 'period']),
+            dtype=int
+        )
+        network_metrics = pd.DataFrame(
+            columns=['collaborations', 'new_ties', 'new_external', 'ties', 'external'], index=no_periods, dtype=int
+        )
+        return staff_metrics, network_metrics
+
+    periods = pd.period_range(edges.period.min(), edges.period.max(), freq=freq, name='period')
+
+    # earliest edge of each tie and of each external collaborator
+    ties = edges.drop_duplicates(['internal', 'external'])
+    externals = ties.drop_duplicates('external')
+
+    new_ties = ties.groupby(['internal', 'period']).size().unstack(fill_value=0)
+    new_ties = new_ties.reindex(columns=periods, fill_value=0)
+
+    staff_metrics = pd.DataFrame({
+        'new_ties': new_ties.stack(),
+        'degree': new_ties.cumsum(axis=1).stack()
+    })
+
+    network_metrics = pd.DataFrame({
+        'collaborations': edges.groupby('period').size(),
+        'new_ties': ties.groupby('period').size(),
+        'new_external': externals.groupby('period').size()
+    }).reindex(periods, fill_value=0)
+
+    network_metrics['ties'] = network_metrics.new_ties.cumsum()
+    network_metrics['external'] = network_metrics.new_external.cumsum()
+
+    return staff_metrics, network_metrics
+
+
+def staff_influence(users_df=None, edges_df=None, depth=2, current_only=True):
+    """
+    For every staff member at once, counts external collaborators that would leave the network without them.
+    As in the notebook's analysis of the network without Brian, removing a staff member removes all edges on projects
+    they contribute to and on the parents of those projects, up to depth levels of the project hierarchy.
+    An external collaborator depends on a staff member if every project they share with staff is such a project,
+    found by comparing per-external project counts with per-external, per-staff counts in one merge and groupby.
+
+    :param users_df: optional users from create_network(), gathered from DB if not provided
+    :param edges_df: optional edges from create_network(), gathered from DB if not provided
+    :param depth: number of levels of parent projects removed along with a staff member's own projects
+    :param current_only: if True, consider current staff and their edges only, otherwise include former staff
+    :return: dataframe indexed by staff 'guid', with columns: 'full_name', 'collaborators' (distinct external
+             collaborators), 'exclusive' (external collaborators only reachable through them), 'remaining'
+             (external collaborators of all considered staff left without them), 'exclusive_share' (exclusive as
+             proportion of all external collaborators of considered staff)
+    """
+    if users_df is None or edges_df is None:
+        users_df, edges_df = create_network()
+
+    staff = users_df[users_df.is_cos == 1] if current_only else users_df[users_df.is_cos.notna()]
+    staff = staff[['guid', 'full_name']].set_index('guid')
+
+    edges = edges_df[edges_df.internal.isin(staff.index)]
+    external_projects = edges[['external', 'project_guid']].drop_duplicates()
+
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    cur.execute("SELECT node, user FROM node_contributors;")
+    touched = pd.DataFrame(cur.fetchall(), columns=['project_guid', 'staff'])
+
+    cur.execute("SELECT parent, child FROM node_relations;")
+    relations = pd.DataFrame(cur.fetchall(), columns=['parent', 'child'])
+
+    conn.close()
+
+    # projects each staff member touches: their own, and parents of those up to depth levels
+    touched = touched[touched.staff.isin(staff.index)]
+    level = touched
+    for _ in range(depth):
+        level = level.merge(relations, left_on='project_guid', right_on='child')[['parent', 'staff']]
+        level = level.rename(columns={'parent': 'project_guid'})
+        touched = pd.concat([touched, level])
+    touched = touched.drop_duplicates()
+
+    num_projects = external_projects.groupby('external').size()
+    num_touched = external_projects.merge(touched, on='project_guid').groupby(['external', 'staff']).size()
+
+    dependent = num_touched[num_touched.values == num_projects.reindex(num_touched.index.get_level_values('external')).values]
+    total = len(num_projects)
+
+    influence = staff.copy()
+    influence['collaborators'] = edges.groupby('internal').external.nunique()
+    influence['exclusive'] = dependent.groupby('staff').size()
+    influence = influence.fillna({'collaborators': 0, 'exclusive': 0}).astype({'collaborators': int, 'exclusive': int})
+    influence['remaining'] = total - influence.exclusive
+    influence['exclusive_share'] = influence.exclusive / total if total else 0.0
+    influence.index.name = 'guid'
+
+    return influence.sort_values('exclusive', ascending=False)
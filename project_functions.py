@@ -1,27 +1,53 @@
-import requests
 import sqlite3
-from config import base_url, headers, db_name
-from user_functions import process_user_socials, process_user_education, process_user_employment, load_user_profile
+from config import base_url, db_name
+from dead_letter import get_json, record_missing
+from crawl_executor import get_request_count
+from user_functions import process_user_response, load_user_profile, MAX_PAGE_SIZE
+from seen_users import is_user_stored
+from change_tracking import find_changed, record_changes, log_new_links
+from reach_sketches import update_reach_sketches
+from compact_schema import insert_links
+
+# contributor relationship table for each supported resource type
+CONTRIBUTOR_TABLES = {
+    'nodes': 'node_contributors',
+    'registrations': 'registration_contributors',
+    'preprints': 'preprint_contributors'
+}
 
 
 def get_project(guid, params=None):
     """
-    Given project node GUID, get node data from OSF. Prints errors to console if request fails.
+    Given project node GUID, get node data from OSF. Prints errors to console if request fails
+    and records failed requests in the dead letter table.
 
     :param guid: OSF GUID of a project
     :param params: additional parameters to pass to request
     :return: dictionary, data key of json response or empty if response failed
     """
 
-    response = requests.get(base_url + '/nodes/' + guid, headers=headers, params=params)
+    resp_json = get_json(base_url + '/nodes/' + guid, 'project', {'guid': guid}, params)
 
-    if response.ok:
-        resp_json = response.json()['data']
-    else:
-        print(f'nodes request failed at {response.url}: {response.status_code} - {response.reason}')
-        resp_json = {}
+    return resp_json.get('data', {})
 
-    return resp_json
+
+def get_projects(guids, params=None):
+    """
+    Given up to MAX_PAGE_SIZE project node GUIDs, get their node data from OSF in one request
+    to the nodes list endpoint filtered by id. Failed requests are recorded in the dead letter table.
+
+    :param guids: list of OSF GUIDs of projects
+    :param params: additional parameters to pass to request
+    :return: list of node entries, each as from get_project(); nodes not found on OSF or not public are missing.
+    None if request failed.
+    """
+    params = {**(params or {}), 'filter[id]': ','.join(guids), 'page[size]': MAX_PAGE_SIZE}
+    resp_json = get_json(base_url + '/nodes/', 'projects', {'guids': guids}, params)
+
+    if not resp_json:
+        return None
+
+    return resp_json.get('data', [])
 
 
 def process_project_tags(response_json):
@@ -45,6 +71,53 @@ def process_project_tags(response_json):
     return tags_insert
 
 
+def process_children_page(parent, data):
+    """
+    Given one page of child nodes of some parent node, prepare lists of tuples for insertion into DB.
+
+    :param parent: OSF GUID of parent node
+    :param data: content of 'data' key from a page of child nodes
+    :return: tuple, two lists:
+             (1) list of node relationship tuples of form (parent, child) for insertion into DB
+             (2) list of node entity tuples of form (id, title, date_created) for insertion into DB
+    """
+    children_insert = [None for _ in range(len(data))]
+    nodes_insert = [None for _ in range(len(data))]
+
+    for ix, child in enumerate(data):
+        children_insert[ix] = (parent, child['id'])
+        nodes_insert[ix] = (child['id'], child['attributes']['title'], child['attributes']['date_created'])
+
+    return children_insert, nodes_insert
+
+
+def get_children_pages(parent, next_page):
+    """
+    Given link to a page of child nodes, request it and all following pages and prepare child nodes for insertion.
+    Failed requests are recorded in the dead letter table with their pagination link.
+
+    :param parent: OSF GUID of parent node
+    :param next_page: link to first page to request, or None
+    :return: tuple, two lists as from process_children_page()
+    """
+    children_insert = []
+    nodes_insert = []
+
+    while next_page is not None:
+        response_json = get_json(next_page, 'node_children_page', {'parent': parent})
+        if not response_json:
+            print('exiting node children pagination requests')
+            break
+
+        children, nodes = process_children_page(parent, response_json['data'])
+        children_insert += children
+        nodes_insert += nodes
+
+        next_page = response_json['links']['next']
+
+    return children_insert, nodes_insert
+
+
 def process_project_children(response_json):
     """
     Given response JSON of request to OSF node with embedded children param, gather all child nodes.
@@ -59,168 +132,263 @@ def process_project_children(response_json):
     """
 
     try:
-        num_children = response_json['embeds']['children']['links']['meta']['total']
+        embedded = response_json['embeds']['children']
+        num_children = embedded['links']['meta']['total']
     except KeyError:
         print(f'missing embedded children in response_json at {response_json["id"]}')
         num_children = 0
 
-    children_insert = [None for _ in range(num_children)]
-    nodes_insert = [None for _ in range(num_children)]
+    if not num_children:
+        return [], []
 
-    if num_children:
-        parent = response_json['id']
-        child_ix = 0
-        node_ix = 0
+    parent = response_json['id']
 
-        for child in response_json['embeds']['children']['data']:
-            children_insert[child_ix] = (parent, child['id'])
-            child_ix += 1
+    children_insert, nodes_insert = process_children_page(parent, embedded['data'])
+    more_children, more_nodes = get_children_pages(parent, embedded['links']['next'])
 
-            nodes_insert[node_ix] = (child['id'], child['attributes']['title'], child['attributes']['date_created'])
-            node_ix += 1
+    return children_insert + more_children, nodes_insert + more_nodes
 
-        next_page = response_json['embeds']['children']['links']['next']
 
-        while next_page is not None:
-            response = requests.get(next_page, headers=headers)
-            if not response.ok:
-                print(f'node children request failed at {response.url}: {response.status_code} - {response.reason}')
-                print('exiting node children pagination requests')
-                break
-            else:
-                response_json = response.json()
+def process_embedded_user(this_user):
+    """
+    Given embedded user data from a contributor entry, parse full user profile for insertion into DB.
 
-            for child in response_json['data']:
-                children_insert[child_ix] = (parent, child['id'])
-                child_ix += 1
+    :param this_user: content of 'data' key of embedded user in a contributor entry
+    :return: dictionary with keys 'user', 'social', 'employment', 'education', as from process_user_profile()
+    """
+    return process_user_response(this_user)
 
-                nodes_insert[node_ix] = (child['id'], child['attributes']['title'], child['attributes']['date_created'])
-                node_ix += 1
 
-            next_page = response_json['links']['next']
+def process_contributors_page(this_node, data, refresh=False, conn=None):
+    """
+    Given one page of contributors of some node, registration, or preprint with embedded users,
+    prepare contributors and user profiles for insertion into DB.
+    Profiles of users already stored in DB are skipped unless refresh is requested.
+
+    :param this_node: OSF GUID of node, registration, or preprint
+    :param data: content of 'data' key from a page of contributors
+    :param refresh: if True, parse profiles of all contributors, including those already stored in DB
+    :param conn: optional open sqlite3 connection to DB used to check for stored users
+    :return: tuple,
+             0: list of contributors tuples of form (user, node) for insertion into contributors table
+             1: list of user profiles as from process_embedded_user() for insertion into users table
+    """
+    contributors_insert = []
+    user_profiles = []
 
-    return children_insert, nodes_insert
+    for contrib in data:
+        try:
+            this_user = contrib['embeds']['users']['data']
+        except KeyError:
+            print('embedded contributor missing data?')
+            print(contrib)
+            continue
+        contributors_insert.append((this_user['id'], this_node))
+
+        if refresh or not is_user_stored(this_user['id'], conn):
+            user_profiles.append(process_embedded_user(this_user))
+
+    return contributors_insert, user_profiles
 
 
-def process_project_contributors(response_json):
+def iter_contributors_pages(this_node, next_page, kind, context, refresh=False, conn=None, params=None):
+    """
+    Given link to a page of contributors, request it and all following pages one at a time,
+    yielding contributors and user profiles of each page as it arrives so only one page is held in memory.
+    Failed requests are recorded in the dead letter table with their pagination link.
+
+    :param this_node: OSF GUID of node, registration, or preprint
+    :param next_page: link to first page to request, or None
+    :param kind: type of request recorded on failure, see dead_letter.record_failure()
+    :param context: values needed to replay a failed request, see dead_letter.record_failure()
+    :param refresh: if True, parse profiles of all contributors, including those already stored in DB
+    :param conn: optional open sqlite3 connection to DB used to check for stored users
+    :param params: additional parameters to pass to first request, following links already carry them
+    :return: generator of tuples of two lists as from process_contributors_page()
+    """
+
+    while next_page is not None:
+        response_json = get_json(next_page, kind, context, params)
+        if not response_json:
+            print(f'exiting {kind} pagination requests')
+            return
+
+        yield process_contributors_page(this_node, response_json['data'], refresh, conn)
+
+        next_page = response_json['links']['next']
+        params = None
+
+
+def iter_project_contributors(response_json, refresh=False):
+    """
+    Given response JSON of request to OSF node with embedded contributors param, yield contributors and user profiles
+    one page at a time: first the embedded page, then each following page as it is requested.
+    Profiles of users already stored in DB are skipped unless refresh is requested.
+
+    :param response_json: content of 'data' key from project (node) response
+    :param refresh: if True, parse profiles of all contributors, including those already stored in DB
+    :return: generator of tuples of two lists as from process_contributors_page()
+    """
+    try:
+        embedded = response_json['embeds']['contributors']
+        num_contributors = embedded['links']['meta']['total']
+    except KeyError:
+        print(f'missing embedded contributors in response_json at {response_json["id"]}')
+        num_contributors = 0
+
+    if not num_contributors:
+        return
+
+    this_node = response_json['id']
+    conn = None if refresh else sqlite3.connect(db_name)
+
+    try:
+        yield process_contributors_page(this_node, embedded['data'], refresh, conn)
+        yield from iter_contributors_pages(
+            this_node, embedded['links']['next'], 'node_contributors_page', {'node': this_node}, refresh, conn
+        )
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def process_project_contributors(response_json, refresh=False):
     """
     Given response JSON of request to OSF node with embedded contributors param, gather all contributors.
     Prepares tuple of lists of contributors and user profiles for insertion into DB.
+    Profiles of users already stored in DB are skipped unless refresh is requested.
     Makes additional requests as necessary to collect additional results if more than one page of contributors exists.
-    Intended to be used with output of get_project().
+    Intended to be used with output of get_project(). See iter_project_contributors() to process page by page.
 
     :param response_json: content of 'data' key from project (node) response
+    :param refresh: if True, parse profiles of all contributors, including those already stored in DB
     :return: tuple,
              0: list of contributors tuples of form (user, node) for insertion into node_contributors table
              1: list of user profiles of form (id, full_name, date_created) for insertion into users table
     """
-    try:
-        num_contributors = response_json['embeds']['contributors']['links']['meta']['total']
-    except KeyError:
-        print(f'missing embedded contributors in response_json at {response_json["id"]}')
-        num_contributors = 0
+    contributors_insert = []
+    user_profiles = []
 
-    contributors_insert = [None for _ in range(num_contributors)]
-    user_profiles = [None for _ in range(num_contributors)]
+    for contributors, users in iter_project_contributors(response_json, refresh):
+        contributors_insert += contributors
+        user_profiles += users
 
-    if num_contributors:
-        this_node = response_json['id']
-        contributors_ix = 0
-        users_ix = 0
+    return contributors_insert, user_profiles
 
-        for contrib in response_json['embeds']['contributors']['data']:
-            this_user = contrib['embeds']['users']['data']
-            contributors_insert[contributors_ix] = (this_user['id'], this_node)
-            contributors_ix += 1
 
-            user_insert = dict()
+def process_project_record(response_json, refresh=False):
+    """
+    Given response JSON of request to OSF node with embedded children and contributors params,
+    gather all tags, child nodes, and contributors and prepare collected data for insertion into DB.
 
-            user_insert['user'] = (
-                this_user['id'],
-                this_user['attributes']['full_name'],
-                this_user['attributes']['date_registered']
-            )
-            user_insert['social'] = process_user_socials(this_user)
-            user_insert['employment'] = process_user_employment(this_user)
-            user_insert['education'] = process_user_education(this_user)
-
-            user_profiles[users_ix] = user_insert
-            users_ix += 1
-
-        next_page = response_json['embeds']['contributors']['links']['next']
-
-        while next_page is not None:
-            response = requests.get(next_page, headers=headers)
-            if not response.ok:
-                print(f'node contributors request failed at {response.url}: {response.status_code} - {response.reason}')
-                print('exiting node contributor pagination requests')
-                break
-            else:
-                response_json = response.json()
-
-            for contrib in response_json['data']:
-                try:
-                    this_user = contrib['embeds']['users']['data']
-                except KeyError:
-                    print('embedded contributor missing data?')
-                    print(contrib)
-                    continue
-                contributors_insert[contributors_ix] = (this_user['id'], this_node)
-                contributors_ix += 1
-
-                user_insert = dict()
-
-                user_insert['user'] = (
-                    this_user['id'],
-                    this_user['attributes']['full_name'],
-                    this_user['attributes']['date_registered']
-                )
-                user_insert['social'] = process_user_socials(this_user)
-                user_insert['employment'] = process_user_employment(this_user)
-                user_insert['education'] = process_user_education(this_user)
-
-                user_profiles[users_ix] = user_insert
-                users_ix += 1
-
-            next_page = response_json['links']['next']
-
-    contributors_insert = list(filter(lambda x: x is not None, contributors_insert))
-    user_profiles = list(filter(lambda x: x is not None, user_profiles))
+    :param response_json: content of 'data' key from project (node) response
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: dictionary as from get_project_record()
+    """
+    project_insert = dict()
 
-    return contributors_insert, user_profiles
+    children, new_nodes = process_project_children(response_json)
+    contributors, new_users = process_project_contributors(response_json, refresh)
+
+    project_insert['tags'] = process_project_tags(response_json)
+    project_insert['children'] = children
+    project_insert['nodes'] = new_nodes
+    project_insert['contributors'] = contributors
+    project_insert['users'] = new_users
+
+    return project_insert
 
 
-def get_project_record(guid):
+def get_project_record(guid, refresh=False):
     """
     Gathers all tags, child nodes, and contributors for some given project GUID.
     Greedily gathers nodes and contributors both in relation to source project and as independent entities.
     Prepares collected data for insertion into DB.
 
     :param guid: OSF GUID of a project
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
     :return: dictionary with keys 'tags', 'children', 'nodes', 'contributors', 'users' where each has a list of objects
     for insertion into DB, or an empty list if data is unavailable.
     All but 'users' will return a list of tuples; 'users' returns a list of dictionaries where each dict is a full
     user profile to be passed to user_functions.load_user_profile.
+    Empty dictionary if the project request failed.
     """
     response_json = get_project(guid, params={'embed': ['children', 'contributors']})
 
-    project_insert = dict()
+    if not response_json:
+        return {}
+
+    return process_project_record(response_json, refresh)
+
 
+def stream_project_response(response_json, refresh=False):
+    """
+    Given response JSON of request to OSF node with embedded children and contributors params,
+    load all tags, child nodes, and contributors as load_project_record(process_project_record()) would,
+    but flush contributors and their profiles to DB page by page as they are requested,
+    so memory use is bounded by page size rather than project size.
+
+    :param response_json: content of 'data' key from project (node) response, or a node entry of a node list response
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: None
+    """
     children, new_nodes = process_project_children(response_json)
-    contributors, new_users = process_project_contributors(response_json)
+    load_project_record(
+        {'tags': process_project_tags(response_json), 'children': children, 'nodes': new_nodes,
+         'contributors': [], 'users': []}
+    )
 
-    project_insert['tags'] = process_project_tags(response_json)
-    project_insert['children'] = children
-    project_insert['nodes'] = new_nodes
-    project_insert['contributors'] = contributors
-    project_insert['users'] = new_users
+    for contributors, users in iter_project_contributors(response_json, refresh):
+        load_project_record({'tags': [], 'children': [], 'nodes': [], 'contributors': contributors, 'users': users})
 
-    return project_insert
+
+def stream_project_record(guid, refresh=False):
+    """
+    Gathers and loads all tags, child nodes, and contributors for some given project GUID,
+    as get_project_record() followed by load_project_record() would, streaming contributors page by page.
+    See stream_project_response().
+
+    :param guid: OSF GUID of a project
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: None
+    """
+    response_json = get_project(guid, params={'embed': ['children', 'contributors']})
+
+    if not response_json:
+        return
+
+    stream_project_response(response_json, refresh)
+
+
+def stream_project_records(guids, refresh=False):
+    """
+    Gathers and loads all tags, child nodes, and contributors for a batch of up to MAX_PAGE_SIZE project GUIDs
+    with one request for all of their node data, streaming contributors of each project page by page.
+    See stream_project_response(). Nodes missing from the response (e.g. deleted or private) are recorded
+    as permanent failures in the dead letter table without requesting them again, so they are left off the frontier.
+    If the batched request fails, it is recorded as a whole.
+
+    :param guids: list of OSF GUIDs of projects
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: None
+    """
+    projects = get_projects(guids, params={'embed': ['children', 'contributors']})
+
+    if projects is None:
+        return
+
+    for response_json in projects:
+        stream_project_response(response_json, refresh)
+
+    missing = record_missing('project', base_url + '/nodes/', guids, [p['id'] for p in projects])
+    if missing:
+        print(f'{len(missing)} of {len(guids)} nodes not returned by batched request, recorded as failed')
 
 
 def load_project_record(project_insert):
     """
-    Given OSF project data, insert or replace user data in appropriate tables in DB.
+    Given OSF project data, insert new relationships and changed nodes and user data in appropriate tables in DB.
+    Rows already stored with the same content are not rewritten.
     Intended to be used with output of get_project_record().
 
     :param project_insert: dictionary from get_project_record(),
@@ -235,47 +403,156 @@ def load_project_record(project_insert):
     conn = sqlite3.connect(db_name)
 
     if project_insert['tags']:
-        conn.executemany(
-            "INSERT OR REPLACE INTO node_tags(id, tag) VALUES (?, ?)",
-            project_insert['tags']
-        )
-        conn.commit()
+        num_rows = insert_links(conn, 'node_tags', project_insert['tags'])
+        log_new_links(conn, 'node_tags', project_insert['tags'][0][0], num_rows)
 
-    if project_insert['children']:
-        conn.executemany(
-            "INSERT OR REPLACE INTO node_relations(parent, child) VALUES (?, ?)",
-            project_insert['children']
-        )
-        conn.commit()
+    children = [c for c in project_insert['children'] if c]
+    if children:
+        num_rows = insert_links(conn, 'node_relations', children)
+        log_new_links(conn, 'node_relations', children[0][0], num_rows)
 
     if project_insert['nodes']:
+        changed = find_changed(conn, 'nodes', [(n[0], n) for n in project_insert['nodes'] if n])
         conn.executemany(
-            "INSERT OR REPLACE INTO nodes(id, title, date_created) VALUES (?, ?, ?)",
-            project_insert['nodes']
+            """
+            INSERT INTO nodes(id, title, date_created) VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET title=excluded.title, date_created=excluded.date_created
+            WHERE title IS NOT excluded.title OR date_created IS NOT excluded.date_created
+            """,
+            [c[1] for c in changed]
         )
-        conn.commit()
+        record_changes(conn, 'nodes', changed)
 
     if project_insert['contributors']:
-        conn.executemany(
-            "INSERT OR REPLACE INTO node_contributors(user, node) VALUES (?, ?)",
-            project_insert['contributors']
-        )
-        conn.commit()
+        num_rows = insert_links(conn, 'node_contributors', project_insert['contributors'])
+        log_new_links(conn, 'node_contributors', project_insert['contributors'][0][1], num_rows)
+        if num_rows > 0:
+            update_reach_sketches(
+                conn, project_insert['contributors'][0][1], [c[0] for c in project_insert['contributors']]
+            )
+
+    conn.commit()
     conn.close()
 
     for u in project_insert['users']:
         load_user_profile(u)
 
 
-def map_get_project_record(guids):
+def map_get_project_record(guids, refresh=False, batch_size=MAX_PAGE_SIZE):
     """
     Allow parallelization of gathering and loading project resources. Intended for use in collect_data.py
+    Node data is requested for batch_size projects at a time with get_projects().
 
     :param guids: iterable of OSF project node GUIDs
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :param batch_size: number of projects per node data request, up to MAX_PAGE_SIZE; 1 requests each project alone
+    :return: int, number of requests made
+    """
+    num_requests = get_request_count()
+    guids = list(guids)
+
+    for i in range(0, len(guids), batch_size):
+        batch = guids[i:i + batch_size]
+        print(f'gathering node data at {", ".join(batch)}')
+        if len(batch) == 1:
+            stream_project_record(batch[0], refresh)
+        else:
+            stream_project_records(batch, refresh)
+
+    return get_request_count() - num_requests
+
+
+def iter_resource_contributors(guid, resource_type, refresh=False):
+    """
+    Gathers contributors for some given registration or preprint GUID one page at a time,
+    yielding contributors and user profiles of each page as it is requested.
+
+    :param guid: OSF GUID of a registration or preprint
+    :param resource_type: one of 'registrations', 'preprints' to indicate what type of resource guid refers to
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: generator of tuples of two lists as from process_contributors_page()
+    """
+    if resource_type not in ['registrations', 'preprints']:
+        print(f'{resource_type} is not supported, must be one of registrations or preprints')
+        return
+
+    conn = None if refresh else sqlite3.connect(db_name)
+
+    try:
+        yield from iter_contributors_pages(
+            guid,
+            f'{base_url}/{resource_type}/{guid}/contributors/',
+            'resource_contributors_page',
+            {'guid': guid, 'resource_type': resource_type},
+            refresh,
+            conn,
+            params={'embed': 'users', 'page[size]': MAX_PAGE_SIZE}
+        )
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def get_resource_record(guid, resource_type, refresh=False):
+    """
+    Gathers all contributors for some given registration or preprint GUID.
+    Makes additional requests as necessary to collect additional results if more than one page of contributors exists.
+    Prepares collected data for insertion into DB.
+
+    :param guid: OSF GUID of a registration or preprint
+    :param resource_type: one of 'registrations', 'preprints' to indicate what type of resource guid refers to
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
+    :return: dictionary with keys 'contributors', 'users', as in get_project_record()
+    """
+    resource_insert = {'contributors': [], 'users': []}
+
+    for contributors, users in iter_resource_contributors(guid, resource_type, refresh):
+        resource_insert['contributors'] += contributors
+        resource_insert['users'] += users
+
+    return resource_insert
+
+
+def load_resource_record(resource_insert, resource_type):
+    """
+    Given OSF registration or preprint contributor data, insert new contributors and user data in DB.
+    Intended to be used with output of get_resource_record().
+
+    :param resource_insert: dictionary from get_resource_record(), expects keys: 'contributors', 'users'
+    :param resource_type: one of 'registrations', 'preprints' to indicate what type of resource is provided
+    :return: None
+    """
+    if resource_insert['contributors']:
+        table = CONTRIBUTOR_TABLES[resource_type]
+
+        conn = sqlite3.connect(db_name)
+        num_rows = insert_links(conn, table, resource_insert['contributors'])
+        log_new_links(conn, table, resource_insert['contributors'][0][1], num_rows)
+        conn.commit()
+        conn.close()
+
+    for u in resource_insert['users']:
+        load_user_profile(u)
+
+
+def map_get_resource_record(resources, refresh=False):
+    """
+    Allow parallelization of gathering and loading contributors of nodes, registrations, and preprints together.
+    Nodes are extended with child nodes and tags as in map_get_project_record().
+    Contributors are loaded page by page. Intended for use in collect_data.py
+
+    :param resources: iterable of tuples of form (guid, resource_type)
+    :param refresh: if True, re-collect profiles of contributors already stored in DB
     :return: None
     """
 
-    for guid in guids:
-        print(f'gathering node data at {guid}')
-        node = get_project_record(guid)
-        load_project_record(node)
+    resources = list(resources)
+
+    map_get_project_record([guid for guid, resource_type in resources if resource_type == 'nodes'], refresh)
+
+    for guid, resource_type in resources:
+        if resource_type == 'nodes':
+            continue
+        print(f'gathering {resource_type} data at {guid}')
+        for contributors, users in iter_resource_contributors(guid, resource_type, refresh):
+            load_resource_record({'contributors': contributors, 'users': users}, resource_type)
@@ -0,0 +1,281 @@
+import math
+import sqlite3
+import hashlib
+import numpy as np
+import pandas as pd
+from config import db_name
+
+# HyperLogLog precision: sketches have 2 ** HLL_PRECISION one-byte registers, standard error 1.04 / sqrt(registers)
+HLL_PRECISION = 12
+
+# bucket of projects without a usable creation date
+UNDATED_BUCKET = 'undated'
+
+
+def new_sketch(precision=HLL_PRECISION):
+    """
+    Create an empty HyperLogLog sketch.
+
+    :param precision: number of hash bits used to pick a register, sketch has 2 ** precision registers
+    :return: bytearray of registers, all zero
+    """
+    return bytearray(1 << precision)
+
+
+def add_to_sketch(sketch, items):
+    """
+    Add items to a HyperLogLog sketch in place. Adding an item already counted leaves the sketch unchanged.
+
+    :param sketch: bytearray from new_sketch()
+    :param items: iterable of strings, e.g. user GUIDs
+    :return: the updated sketch
+    """
+    precision = len(sketch).bit_length() - 1
+    width = 64 - precision
+
+    for item in items:
+        h = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+        register = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > sketch[register]:
+            sketch[register] = rank
+
+    return sketch
+
+
+def merge_sketches(sketches):
+    """
+    Merge HyperLogLog sketches of the same precision, e.g. of several staff members, time buckets, or DB shards.
+    The merged sketch counts the union of the items of all sketches.
+
+    :param sketches: iterable of sketches as bytes or bytearray
+    :return: merged sketch as bytearray, None if no sketches were given
+    """
+    merged = None
+
+    for sketch in sketches:
+        registers = np.frombuffer(sketch, dtype=np.uint8)
+        merged = registers.copy() if merged is None else np.maximum(merged, registers)
+
+    return None if merged is None else bytearray(merged.tobytes())
+
+
+def estimate_sketch(sketch):
+    """
+    Estimate number of distinct items counted by a HyperLogLog sketch, using linear counting for small counts.
+    The relative standard error of the estimate is given by sketch_error().
+
+    :param sketch: sketch as bytes or bytearray
+    :return: float, estimated number of distinct items
+    """
+    registers = np.frombuffer(sketch, dtype=np.uint8)
+    m = len(registers)
+
+    estimate = 0.7213 / (1 + 1.079 / m) * m ** 2 / np.sum(np.exp2(-registers.astype(float)))
+    num_zero = int(np.sum(registers == 0))
+
+    if estimate <= 2.5 * m and num_zero:
+        estimate = m * math.log(m / num_zero)
+
+    return float(estimate)
+
+
+def sketch_error(precision=HLL_PRECISION):
+    """
+    Relative standard error of HyperLogLog estimates, about 1.6% at the default precision.
+
+    :param precision: precision of the sketches
+    :return: float
+    """
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def _bucket(date_created):
+    """
+    Time bucket of a project: year of its creation date.
+    """
+    return date_created[:4] if date_created else UNDATED_BUCKET
+
+
+def _update_sketches(conn, additions):
+    """
+    Add collaborators to stored sketches, creating missing sketches. Does not commit.
+
+    :param conn: open sqlite3 connection to DB
+    :param additions: dictionary of (staff, bucket) to set of collaborator GUIDs
+    :return: None
+    """
+    for (staff, bucket), collaborators in additions.items():
+        row = conn.execute(
+            "SELECT sketch FROM reach_sketches WHERE staff = ? AND bucket = ?",
+            (staff, bucket)
+        ).fetchone()
+        sketch = add_to_sketch(bytearray(row[0]) if row else new_sketch(), collaborators)
+        conn.execute(
+            "INSERT OR REPLACE INTO reach_sketches(staff, bucket, sketch) VALUES (?, ?, ?)",
+            (staff, bucket, bytes(sketch))
+        )
+
+
+def update_reach_sketches(conn, node, new_users):
+    """
+    Update sketches of staff contributing to a project after contributors were loaded, page by page:
+    newly loaded external collaborators are added to the sketches of all staff on the project,
+    and all external collaborators on the project are added to the sketches of newly loaded staff.
+    Must run in the transaction that inserted the contributors, which holds the DB write lock, so concurrent
+    workers cannot interleave updates of the same sketch. Does not commit.
+
+    :param conn: open sqlite3 connection to DB
+    :param node: OSF GUID of the project
+    :param new_users: GUIDs of contributors just loaded for the project; re-adding known contributors is harmless
+    :return: None
+    """
+    if not new_users:
+        return
+
+    row = conn.execute("SELECT date_created FROM nodes WHERE id = ?", (node,)).fetchone()
+    bucket = _bucket(row[0] if row else None)
+
+    cur = conn.execute(
+        """
+        SELECT c.user,
+               cos.id IS NOT NULL
+          FROM node_contributors c
+          LEFT JOIN cos_staff cos ON c.user=cos.id
+         WHERE c.node = ?;
+        """,
+        (node,)
+    )
+    contributors = cur.fetchall()
+
+    staff = {user for user, is_staff in contributors if is_staff}
+    if not staff:
+        return
+
+    external = {user for user, is_staff in contributors if not is_staff}
+    new_users = set(new_users)
+
+    additions = dict()
+    for s in staff:
+        collaborators = external if s in new_users else external & new_users
+        if collaborators:
+            additions[(s, bucket)] = collaborators
+
+    _update_sketches(conn, additions)
+
+
+def build_reach_sketches():
+    """
+    Rebuild all sketches from the collaborations stored in DB, e.g. after the cos_staff table changed
+    or for a DB collected before sketches were kept.
+
+    :return: None
+    """
+    conn = sqlite3.connect(db_name)
+
+    cur = conn.execute(
+        """
+        SELECT s.user,
+               e.user,
+               n.date_created
+          FROM node_contributors s
+          JOIN cos_staff cos ON s.user=cos.id
+          JOIN node_contributors e ON s.node=e.node
+          LEFT JOIN nodes n ON s.node=n.id
+         WHERE e.user NOT IN (SELECT id FROM cos_staff);
+        """
+    )
+
+    additions = dict()
+    for staff, external, date_created in cur:
+        additions.setdefault((staff, _bucket(date_created)), set()).add(external)
+
+    conn.execute("DELETE FROM reach_sketches;")
+    _update_sketches(conn, additions)
+    conn.commit()
+    conn.close()
+
+
+def merge_reach_shard(shard_db_name):
+    """
+    Merge sketches collected in another DB, e.g. by a crawl of a separate shard of projects, into this DB.
+
+    :param shard_db_name: file name of the other DB
+    :return: None
+    """
+    shard = sqlite3.connect(shard_db_name)
+    shard_sketches = shard.execute("SELECT staff, bucket, sketch FROM reach_sketches;").fetchall()
+    shard.close()
+
+    conn = sqlite3.connect(db_name)
+
+    for staff, bucket, sketch in shard_sketches:
+        row = conn.execute(
+            "SELECT sketch FROM reach_sketches WHERE staff = ? AND bucket = ?",
+            (staff, bucket)
+        ).fetchone()
+        if row:
+            sketch = bytes(merge_sketches([row[0], sketch]))
+        conn.execute(
+            "INSERT OR REPLACE INTO reach_sketches(staff, bucket, sketch) VALUES (?, ?, ?)",
+            (staff, bucket, sketch)
+        )
+
+    conn.commit()
+    conn.close()
+
+
+def get_reach(staff=None, buckets=None):
+    """
+    Estimate number of distinct external collaborators of a group of staff members over a set of time buckets,
+    by merging their sketches. Memory use is constant in the number of collaborations.
+
+    :param staff: optional iterable of staff GUIDs, all staff if not provided
+    :param buckets: optional iterable of buckets (years as 'YYYY' or 'undated'), all buckets if not provided
+    :return: tuple, (estimated number of distinct external collaborators, relative standard error)
+    """
+    query = "SELECT sketch FROM reach_sketches WHERE 1=1"
+    params = []
+
+    for column, values in [('staff', staff), ('bucket', buckets)]:
+        if values is not None:
+            values = list(values)
+            query += f" AND {column} IN ({','.join('?' * len(values))})"
+            params += values
+
+    conn = sqlite3.connect(db_name)
+    merged = merge_sketches(s[0] for s in conn.execute(query, params))
+    conn.close()
+
+    if merged is None:
+        return 0.0, sketch_error()
+
+    return estimate_sketch(merged), sketch_error(len(merged).bit_length() - 1)
+
+
+def reach_by_staff(cumulative=False):
+    """
+    Estimate number of distinct external collaborators of each staff member per time bucket,
+    as an approximate, constant-memory alternative to deduplicating the edges of create_network().
+
+    :param cumulative: if True, estimate distinct collaborators up to and including each bucket
+    :return: dataframe with columns: 'staff', 'bucket', 'reach', sorted by staff and bucket
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.execute("SELECT staff, bucket, sketch FROM reach_sketches ORDER BY staff, bucket;")
+
+    reach = []
+    staff = None
+    running = None
+    for s, bucket, sketch in cur:
+        if s != staff:
+            staff = s
+            running = None
+        if cumulative:
+            running = merge_sketches([sketch] if running is None else [running, sketch])
+            sketch = running
+        reach.append((s, bucket, estimate_sketch(sketch)))
+
+    conn.close()
+
+    return pd.DataFrame(reach, columns=['staff', 'bucket', 'reach'])
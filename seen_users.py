@@ -0,0 +1,104 @@
+import hashlib
+import sqlite3
+from math import ceil, log
+from multiprocessing.sharedctypes import RawArray
+from config import db_name
+
+# bloom filter shared by all workers of a process pool, set by init_seen_users()
+_seen_bits = None
+_num_hashes = 0
+
+
+def create_seen_users(capacity=1000000, error_rate=0.01):
+    """
+    Create a Bloom filter of user GUIDs in shared memory, sized for capacity users at the given false positive rate.
+    Prefilled with every user already stored in DB.
+    Intended to be passed as initargs to a process pool with init_seen_users() as initializer.
+
+    :param capacity: expected number of distinct users
+    :param error_rate: acceptable false positive rate of the filter
+    :return: tuple, (shared bit array, number of hash functions)
+    """
+
+    num_bits = ceil(-capacity * log(error_rate) / log(2) ** 2)
+    num_hashes = max(1, round(num_bits / capacity * log(2)))
+    bits = RawArray('B', ceil(num_bits / 8))
+
+    init_seen_users(bits, num_hashes)
+
+    conn = sqlite3.connect(db_name)
+    for (guid,) in conn.execute("SELECT id FROM users"):
+        mark_user_seen(guid)
+    conn.close()
+
+    return bits, num_hashes
+
+
+def init_seen_users(bits, num_hashes):
+    """
+    Attach this process to a shared Bloom filter created by create_seen_users(). Intended as process pool initializer.
+
+    :param bits: shared bit array from create_seen_users()
+    :param num_hashes: number of hash functions from create_seen_users()
+    :return: None
+    """
+    global _seen_bits, _num_hashes
+
+    _seen_bits = bits
+    _num_hashes = num_hashes
+
+
+def _bit_positions(guid):
+    """
+    Derive Bloom filter bit positions for a GUID by double hashing a single digest.
+
+    :param guid: OSF GUID of a user profile
+    :return: generator of bit positions
+    """
+    digest = hashlib.blake2b(guid.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    num_bits = len(_seen_bits) * 8
+
+    return ((h1 + i * h2) % num_bits for i in range(_num_hashes))
+
+
+def mark_user_seen(guid):
+    """
+    Add user GUID to the shared Bloom filter. Does nothing if this process has no filter attached.
+
+    :param guid: OSF GUID of a user profile
+    :return: None
+    """
+    if _seen_bits is None:
+        return
+
+    for pos in _bit_positions(guid):
+        _seen_bits[pos >> 3] |= 1 << (pos & 7)
+
+
+def is_user_stored(guid, conn=None):
+    """
+    Check whether a user profile is already stored in DB.
+    Users missing from the shared Bloom filter are known to be new without querying DB;
+    possible hits are confirmed against the users table.
+
+    :param guid: OSF GUID of a user profile
+    :param conn: optional open sqlite3 connection to DB, one is opened if not provided
+    :return: bool, True if user profile is in DB
+    """
+    if _seen_bits is not None:
+        for pos in _bit_positions(guid):
+            if not _seen_bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+    close = conn is None
+    if close:
+        conn = sqlite3.connect(db_name)
+
+    stored = conn.execute("SELECT 1 FROM users WHERE id = ?", (guid,)).fetchone() is not None
+
+    if close:
+        conn.close()
+
+    return stored
@@ -0,0 +1,87 @@
+import sqlite3
+import pandas as pd
+from config import db_name
+from network_functions import create_network
+
+# title full-text index of each resource type, see db_setup.py
+TITLE_INDEXES = {
+    'nodes': 'nodes_fts',
+    'registrations': 'registrations_fts',
+    'preprints': 'preprints_fts'
+}
+
+
+def search_projects(query, resource_types=('nodes', 'registrations', 'preprints'), include_tags=True):
+    """
+    Full-text search of titles of nodes, registrations, and preprints, and of node tags.
+    Uses the FTS5 indexes created in db_setup.py, so queries support FTS5 syntax, e.g. 'replicat*' or
+    'preregistration OR "registered report"'.
+
+    :param query: FTS5 query string
+    :param resource_types: resource types whose titles are searched
+    :param include_tags: if True, also match nodes by their tags
+    :return: dataframe with columns: 'guid', 'resource_type', 'title', 'rank' (bm25, lower is more relevant),
+             one row per matching resource, most relevant first
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    matches = []
+
+    for resource_type in resource_types:
+        fts = TITLE_INDEXES[resource_type]
+        cur.execute(
+            f"""
+            SELECT r.id,
+                   ?,
+                   r.title,
+                   bm25({fts})
+              FROM {fts}
+              JOIN {resource_type} r ON r.rowid={fts}.rowid
+             WHERE {fts} MATCH ?;
+            """,
+            (resource_type, query)
+        )
+        matches += cur.fetchall()
+
+    if include_tags:
+        cur.execute(
+            """
+            SELECT g.guid,
+                   'nodes',
+                   n.title,
+                   bm25(tags_fts)
+              FROM tags_fts
+              JOIN node_tags_int t ON t.tag=tags_fts.rowid
+              JOIN guids g ON t.id=g.id
+              LEFT JOIN nodes n ON g.guid=n.id
+             WHERE tags_fts MATCH ?;
+            """,
+            (query,)
+        )
+        matches += cur.fetchall()
+
+    conn.close()
+
+    matches_df = pd.DataFrame(matches, columns=['guid', 'resource_type', 'title', 'rank'])
+    matches_df = matches_df.sort_values('rank').drop_duplicates(['guid', 'resource_type'])
+
+    return matches_df.reset_index(drop=True)
+
+
+def create_topic_network(query, include_tags=True):
+    """
+    Gathers users and their co-collaborations on nodes matching a full-text query, see search_projects().
+    Only node contributors are used to define collaborations, as in create_network().
+
+    :param query: FTS5 query string
+    :param include_tags: if True, also match nodes by their tags
+    :return: tuple, three dataframes:
+             (1) users as from create_network()
+             (2) edges as from create_network(), restricted to matching projects
+             (3) matching projects as from search_projects()
+    """
+    projects_df = search_projects(query, resource_types=('nodes',), include_tags=include_tags)
+    users_df, edges_df = create_network(projects=projects_df.guid.values)
+
+    return users_df, edges_df, projects_df
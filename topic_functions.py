@@ -0,0 +1,163 @@
+import re
+import sqlite3
+import unicodedata
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from config import db_name
+
+
+def normalize_tag(tag):
+    """
+    Normalize a tag so variants of the same term share one vocabulary entry: unicode-normalize, casefold,
+    and collapse whitespace, hyphens, and underscores into single spaces.
+
+    :param tag: tag as entered on OSF
+    :return: str, normalized tag, empty if tag has no content
+    """
+    tag = unicodedata.normalize('NFKC', tag).casefold()
+
+    return re.sub(r'[\s_\-]+', ' ', tag).strip()
+
+
+def create_tag_matrix():
+    """
+    Gathers all node tags from DB and builds a sparse binary project x tag matrix over the normalized tag vocabulary.
+    Projects and tags are interned as integer ids: row i is projects[i] and column j is tags[j].
+
+    :return: tuple,
+             (1) scipy.sparse csr matrix of shape (number of projects, number of tags)
+             (2) pandas Index of project GUIDs, one per row
+             (3) pandas Index of normalized tags, one per column
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    cur.execute("SELECT id, tag FROM node_tags;")
+    tags_df = pd.DataFrame(cur.fetchall(), columns=['project_guid', 'tag'])
+
+    conn.close()
+
+    tags_df['tag'] = tags_df.tag.map(normalize_tag)
+    tags_df = tags_df[tags_df.tag != ''].drop_duplicates()
+
+    project_ids, projects = pd.factorize(tags_df.project_guid)
+    tag_ids, tags = pd.factorize(tags_df.tag)
+
+    tag_matrix = sparse.csr_matrix(
+        (np.ones(len(tags_df), dtype=np.float32), (project_ids, tag_ids)),
+        shape=(len(projects), len(tags))
+    )
+
+    return tag_matrix, pd.Index(projects), pd.Index(tags)
+
+
+def tag_cooccurrence(tag_matrix, tags, min_count=1):
+    """
+    Counts how many projects each pair of tags appears on together.
+
+    :param tag_matrix: project x tag matrix from create_tag_matrix()
+    :param tags: tag index from create_tag_matrix()
+    :param min_count: minimum number of shared projects for a pair to be returned
+    :return: dataframe with columns: 'tag_a', 'tag_b', 'num_projects', one row per pair, most frequent first
+    """
+    cooccurrence = sparse.triu(tag_matrix.T @ tag_matrix, k=1).tocoo()
+    keep = cooccurrence.data >= min_count
+
+    cooccurrence_df = pd.DataFrame({
+        'tag_a': tags[cooccurrence.row[keep]],
+        'tag_b': tags[cooccurrence.col[keep]],
+        'num_projects': cooccurrence.data[keep].astype(int)
+    })
+
+    return cooccurrence_df.sort_values('num_projects', ascending=False).reset_index(drop=True)
+
+
+def create_user_topics(tag_matrix, projects, idf=True):
+    """
+    Builds per-user topic profiles, user x tag, by multiplying the user x project contributor incidence matrix
+    with the project x tag matrix. Profiles are L2-normalized so their dot product is cosine similarity.
+
+    :param tag_matrix: project x tag matrix from create_tag_matrix()
+    :param projects: project index from create_tag_matrix()
+    :param idf: if True, weight tags by inverse document frequency to discount tags used on many projects
+    :return: tuple,
+             (1) scipy.sparse csr matrix of shape (number of users, number of tags)
+             (2) pandas Index of user GUIDs, one per row
+    """
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    cur.execute("SELECT user, node FROM node_contributors;")
+    contributors_df = pd.DataFrame(cur.fetchall(), columns=['user', 'project_guid'])
+
+    conn.close()
+
+    project_ids = projects.get_indexer(contributors_df.project_guid)
+    contributors_df = contributors_df[project_ids >= 0]
+    project_ids = project_ids[project_ids >= 0]
+
+    user_ids, users = pd.factorize(contributors_df.user)
+
+    incidence = sparse.csr_matrix(
+        (np.ones(len(user_ids), dtype=np.float32), (user_ids, project_ids)),
+        shape=(len(users), len(projects))
+    )
+
+    user_topics = incidence @ tag_matrix
+
+    if idf:
+        document_frequency = np.asarray((tag_matrix > 0).sum(axis=0)).ravel()
+        user_topics = user_topics @ sparse.diags(np.log((1 + len(projects)) / (1 + document_frequency)) + 1)
+
+    norms = np.sqrt(np.asarray(user_topics.multiply(user_topics).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    user_topics = sparse.diags(1 / norms) @ user_topics
+
+    return sparse.csr_matrix(user_topics), pd.Index(users)
+
+
+def topic_similarity(user_topics, users, guids_a, guids_b=None):
+    """
+    Cosine topic similarity between two groups of users, e.g. COS staff and all users, as one sparse product.
+    Users without tagged projects have no profile and are dropped.
+
+    :param user_topics: user x tag matrix from create_user_topics()
+    :param users: user index from create_user_topics()
+    :param guids_a: iterable of user GUIDs, rows of result
+    :param guids_b: optional iterable of user GUIDs, columns of result, all users if not provided
+    :return: tuple,
+             (1) scipy.sparse csr matrix of similarities of shape (len(rows), len(columns))
+             (2) pandas Index of row user GUIDs
+             (3) pandas Index of column user GUIDs
+    """
+    rows = pd.Index(guids_a).intersection(users, sort=False)
+    columns = users if guids_b is None else pd.Index(guids_b).intersection(users, sort=False)
+
+    similarity = user_topics[users.get_indexer(rows)] @ user_topics[users.get_indexer(columns)].T
+
+    return sparse.csr_matrix(similarity), rows, columns
+
+
+def edge_topic_similarity(edges_df, user_topics, users):
+    """
+    Adds cosine topic similarity of staff member and external collaborator to each collaboration edge.
+
+    :param edges_df: edges from network_functions.create_network()
+    :param user_topics: user x tag matrix from create_user_topics()
+    :param users: user index from create_user_topics()
+    :return: copy of edges_df with column 'similarity', NaN where either user has no topic profile
+    """
+    edges = edges_df.copy()
+
+    internal_ids = users.get_indexer(edges.internal)
+    external_ids = users.get_indexer(edges.external)
+    known = (internal_ids >= 0) & (external_ids >= 0)
+
+    similarity = np.full(len(edges), np.nan)
+    similarity[known] = np.asarray(
+        user_topics[internal_ids[known]].multiply(user_topics[external_ids[known]]).sum(axis=1)
+    ).ravel()
+    edges['similarity'] = similarity
+
+    return edges
@@ -1,29 +1,36 @@
-import requests
 import sqlite3
 import functools
-from multiprocessing import Pool
 from math import ceil
-from config import base_url, headers, db_name
+from config import base_url, db_name
+from crawl_executor import get_executor
+from dead_letter import get_json, record_missing
+from seen_users import mark_user_seen
+from change_tracking import find_changed, record_changes
+
+# largest page size accepted by the OSF API for list endpoints
+MAX_PAGE_SIZE = 100
+
+# date field collected for each supported resource type
+RESOURCE_DATE_FIELDS = {
+    'nodes': 'date_created',
+    'registrations': 'date_registered',
+    'preprints': 'date_published'
+}
 
 
 # for some user, collect: name, date_registered, socials, employment, education
 def get_user(guid):
     """
-    Given user GUID, get user profile data from OSF. Prints errors to console if request fails.
+    Given user GUID, get user profile data from OSF. Prints errors to console if request fails
+    and records failed requests in the dead letter table.
 
     :param guid: OSF GUID of a user profile
     :return: dictionary, data key of json response or empty if response failed
     """
 
-    response = requests.get(base_url + '/users/' + guid, headers=headers)
-
-    if response.ok:
-        resp_json = response.json()['data']
-    else:
-        print(f'users request failed at {response.url}: {response.status_code} - {response.reason}')
-        resp_json = {}
+    resp_json = get_json(base_url + '/users/' + guid, 'user', {'guid': guid})
 
-    return resp_json
+    return resp_json.get('data', {})
 
 
 def process_user_socials(response_json):
@@ -180,21 +187,16 @@ def process_user_education(response_json):
     return education
 
 
-def process_user_profile(guid):
+def process_user_response(user_resp):
     """
-    Given user GUID, get user profile data from OSF. Parse to create lists of profile information regarding
-    social media platforms, education, and employment history.
+    Given OSF user response dictionary, parse name, date registered, socials, employment, and education
+    for insertion into DB.
 
-    :param guid: OSF GUID of a user profile
+    :param user_resp: content of 'data' key from user profile response, or a user entry of a user list response
     :return: dictionary with keys 'user', 'social', 'employment', 'education', where each has a list of tuples
     for insertion into DB, or an empty list if data is unavailable.
     """
-
-    user_resp = get_user(guid)
-    user_insert = {}
-
-    if not user_resp:
-        return user_insert
+    user_insert = dict()
 
     user_insert['user'] = (
         user_resp['id'],
@@ -208,9 +210,70 @@ def process_user_profile(guid):
     return user_insert
 
 
+def process_user_profile(guid):
+    """
+    Given user GUID, get user profile data from OSF. Parse to create lists of profile information regarding
+    social media platforms, education, and employment history.
+
+    :param guid: OSF GUID of a user profile
+    :return: dictionary with keys 'user', 'social', 'employment', 'education', where each has a list of tuples
+    for insertion into DB, or an empty list if data is unavailable.
+    """
+
+    user_resp = get_user(guid)
+
+    if not user_resp:
+        return {}
+
+    return process_user_response(user_resp)
+
+
+def get_users(guids):
+    """
+    Given up to MAX_PAGE_SIZE user GUIDs, get their profile data from OSF in one request
+    to the users list endpoint filtered by id. Failed requests are recorded in the dead letter table,
+    as are users missing from the response, see dead_letter.record_missing().
+
+    :param guids: list of OSF GUIDs of user profiles
+    :return: list of user entries, as from get_user(); users not found on OSF are missing.
+    None if request failed.
+    """
+    params = {'filter[id]': ','.join(guids), 'page[size]': MAX_PAGE_SIZE}
+    resp_json = get_json(base_url + '/users/', 'users', {'guids': guids}, params)
+
+    if not resp_json:
+        return None
+
+    users = resp_json.get('data', [])
+    missing = record_missing('user', base_url + '/users/', guids, [u['id'] for u in users])
+    if missing:
+        print(f'{len(missing)} of {len(guids)} users not returned by batched request, recorded as failed')
+
+    return users
+
+
+def process_user_profiles(guids, batch_size=MAX_PAGE_SIZE):
+    """
+    Given user GUIDs, get and parse their profiles as process_user_profile() would,
+    batching batch_size users per request with get_users().
+
+    :param guids: iterable of OSF GUIDs of user profiles
+    :param batch_size: number of users per request, up to MAX_PAGE_SIZE
+    :return: list of dictionaries as from process_user_profile(), one per user found on OSF
+    """
+    guids = list(guids)
+    user_inserts = []
+
+    for i in range(0, len(guids), batch_size):
+        user_inserts += [process_user_response(user_resp) for user_resp in get_users(guids[i:i + batch_size]) or []]
+
+    return user_inserts
+
+
 def load_user_profile(user_insert):
     """
-    Given OSF user data, insert or replace user data in appropriate tables in DB.
+    Given OSF user data, insert or update user data in appropriate tables in DB.
+    Profiles whose content is unchanged since they were last loaded are skipped without writing.
     Intended to be used with process_user_profile().
 
     :param user_insert: dictionary from process_user_profile(), expects keys: 'user', 'social', 'employment', 'education'
@@ -223,44 +286,68 @@ def load_user_profile(user_insert):
 
     conn = sqlite3.connect(db_name)
 
+    changed = []
+    if user_insert['user']:
+        changed = find_changed(conn, 'users', [(user_insert['user'][0], user_insert)])
+
+    if user_insert['user'] and not changed:
+        conn.close()
+        mark_user_seen(user_insert['user'][0])
+        return
+
     if user_insert['user']:
         conn.execute(
-            "INSERT OR REPLACE INTO users(id, full_name, date_created) VALUES (?, ?, ?)",
+            """
+            INSERT INTO users(id, full_name, date_created) VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET full_name=excluded.full_name, date_created=excluded.date_created
+            WHERE full_name IS NOT excluded.full_name OR date_created IS NOT excluded.date_created
+            """,
             user_insert['user']
         )
-        conn.commit()
 
     if user_insert['social']:
         conn.executemany(
-            "INSERT OR REPLACE INTO socials(id, platform, name) VALUES (?, ?, ?)",
+            "INSERT OR IGNORE INTO socials(id, platform, name) VALUES (?, ?, ?)",
             user_insert['social']
         )
-        conn.commit()
 
     if user_insert['employment']:
         conn.executemany(
             """
-            INSERT OR REPLACE INTO jobs(id, title, institution, start_year, end_year, ongoing) 
+            INSERT INTO jobs(id, title, institution, start_year, end_year, ongoing) 
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id, title, institution) DO UPDATE 
+               SET start_year=excluded.start_year, end_year=excluded.end_year, ongoing=excluded.ongoing
+             WHERE start_year IS NOT excluded.start_year OR 
+                   end_year IS NOT excluded.end_year OR 
+                   ongoing IS NOT excluded.ongoing
             """,
             user_insert['employment']
         )
-        conn.commit()
 
     if user_insert['education']:
         conn.executemany(
             """
-            INSERT OR REPLACE INTO education(id, degree, institution, start_year, end_year, ongoing) 
+            INSERT INTO education(id, degree, institution, start_year, end_year, ongoing) 
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id, degree, institution) DO UPDATE 
+               SET start_year=excluded.start_year, end_year=excluded.end_year, ongoing=excluded.ongoing
+             WHERE start_year IS NOT excluded.start_year OR 
+                   end_year IS NOT excluded.end_year OR 
+                   ongoing IS NOT excluded.ongoing
             """,
             user_insert['education']
         )
-        conn.commit()
 
+    record_changes(conn, 'users', changed)
+    conn.commit()
     conn.close()
 
+    if user_insert['user']:
+        mark_user_seen(user_insert['user'][0])
+
 
-def get_user_resources(guid, resource_type, page):
+def get_user_resources(guid, resource_type, page, page_size=MAX_PAGE_SIZE):
     """
     Given user GUID, get one page of nodes of some type from OSF.
     For projects and registrations, restrict to just top-level nodes.
@@ -269,7 +356,9 @@ def get_user_resources(guid, resource_type, page):
     :param resource_type: one of 'nodes', 'registrations', 'preprints' to indicate what type of resource to request
     from OSF
     :param page: int, which page of results to request
-    :return: response json if response is successful, else empty dictionary
+    :param page_size: int, number of results per page, up to MAX_PAGE_SIZE
+    :return: response json if response is successful, else empty dictionary.
+    failed requests are recorded in the dead letter table.
     """
     resp_json = {}
 
@@ -278,17 +367,13 @@ def get_user_resources(guid, resource_type, page):
         print(f'exiting process at get_user_resources({guid}, {resource_type}, {page})')
         return resp_json
 
-    params = {'page': page}
+    params = {'page': page, 'page[size]': page_size}
     if resource_type != 'preprints':
         params['filter[parent]'] = ''
 
     nodes_url = f'{base_url}/users/{guid}/{resource_type}'
-    resp = requests.get(nodes_url, headers=headers, params=params)
-
-    if resp.ok:
-        resp_json = resp.json()
-    else:
-        print(f'{resource_type} request failed at {resp.url}: {resp.status_code} - {resp.reason}')
+    context = {'guid': guid, 'resource_type': resource_type}
+    resp_json = get_json(nodes_url, 'user_resources', context, params)
 
     return resp_json
 
@@ -304,7 +389,7 @@ def concat_lists(list_a, list_b):
     return list_a + list_b
 
 
-def map_get_user_resources(guid, resource_type, page_range):
+def map_get_user_resources(guid, resource_type, page_range, page_size=MAX_PAGE_SIZE):
     """
     Maps get_user_resources() to provided page_range.
     Processes resource data to prepare for insertion into DB.
@@ -313,6 +398,7 @@ def map_get_user_resources(guid, resource_type, page_range):
     :param resource_type: one of 'nodes', 'registrations', 'preprints' to indicate what type of resource to request
     from OSF. also used to determine which date field to gather from response.
     :param page_range: iterable of integers representing pages to be passed to get_user_resources()
+    :param page_size: int, number of results per page, must match page size used to compute page_range
     :return: list of projects as tuples with form (guid, title, date_field)
     """
 
@@ -326,16 +412,16 @@ def map_get_user_resources(guid, resource_type, page_range):
         print('resource_type is not supported, exiting process')
         return
 
-    projects = [None for _ in range(len(page_range)*10)]
+    projects = [None for _ in range(len(page_range)*page_size)]
     ix = 0
 
     for page in page_range:
 
-        response = get_user_resources(guid, resource_type, page)
+        response = get_user_resources(guid, resource_type, page, page_size)
         if not response:
+            # failed page is recorded in dead letter table, continue with remaining pages
             print(f'empty project response for user {guid} on page {page}')
-            print('exiting process')
-            break
+            continue
 
         for node in response['data']:
             projects[ix] = (node['id'], node['attributes']['title'], node['attributes'][date_field])
@@ -344,7 +430,7 @@ def map_get_user_resources(guid, resource_type, page_range):
     return projects
 
 
-def map_reduce_get_user_resources(guid, resource_type, num_processes=2):
+def map_reduce_get_user_resources(guid, resource_type, num_processes=2, page_size=MAX_PAGE_SIZE):
     """
     Gathers all nodes of some type for a given user.
     Makes initial request to user/{guid}/{resource_type} endpoint to determine how many pages of results to expect.
@@ -354,11 +440,12 @@ def map_reduce_get_user_resources(guid, resource_type, num_processes=2):
     :param guid: OSF GUID of a user profile
     :param resource_type: one of 'nodes', 'registrations', 'preprints' to indicate what type of resource to request
     from OSF. also used to determine which date field to gather from response.
-    :param num_processes: how many processes to instantiate in process pool
+    :param num_processes: how many chunks to split pages into, and workers to start if no executor is running
+    :param page_size: int, number of results per page, defaults to the maximum allowed by the OSF API
     :return: list of nodes as tuples with form (guid, title, date_field)
     """
 
-    response = get_user_resources(guid, resource_type, page=1)
+    response = get_user_resources(guid, resource_type, page=1, page_size=page_size)
 
     if not response:
         return
@@ -373,14 +460,14 @@ def map_reduce_get_user_resources(guid, resource_type, num_processes=2):
         print('resource_type is not supported, exiting process')
         return
 
-    initial_nodes = [None for _ in range(10)]
+    initial_nodes = [None for _ in range(page_size)]
     ix = 0
 
     for node in response['data']:
         initial_nodes[ix] = (node['id'], node['attributes']['title'], node['attributes'][date_field])
         ix += 1
 
-    num_pages = ceil(response['links']['meta']['total'] / 10)
+    num_pages = ceil(response['links']['meta']['total'] / page_size)
 
     if num_pages <= 1:
         return list(filter(lambda x: x is not None, initial_nodes))
@@ -389,10 +476,11 @@ def map_reduce_get_user_resources(guid, resource_type, num_processes=2):
 
     chunk_len = ceil(len(pages) / num_processes)
 
-    chunks = [(guid, resource_type, pages[i:i + chunk_len]) for i in range(0, len(pages), chunk_len)]
+    chunks = [(guid, resource_type, pages[i:i + chunk_len], page_size) for i in range(0, len(pages), chunk_len)]
 
-    with Pool(num_processes) as pool:
-        chunk_results = pool.starmap(map_get_user_resources, chunks)
+    executor = get_executor(num_processes)
+    futures = [executor.submit(map_get_user_resources, *chunk) for chunk in chunks]
+    chunk_results = [future.result() for future in futures]
 
     nodes = functools.reduce(concat_lists, chunk_results)
 
@@ -403,9 +491,54 @@ def map_reduce_get_user_resources(guid, resource_type, num_processes=2):
     return resources
 
 
+def map_reduce_get_user_all_resources(guid, num_processes=2, page_size=MAX_PAGE_SIZE):
+    """
+    Gathers all nodes, registrations, and preprints for a given user in one pass.
+    Requests the first page of each resource type concurrently to determine how many pages of results to expect,
+    then maps the remaining pages of all resource types together to map_get_user_resources().
+
+    :param guid: OSF GUID of a user profile
+    :param num_processes: how many chunks to split pages into, and workers to start if no executor is running
+    :param page_size: int, number of results per page, defaults to the maximum allowed by the OSF API
+    :return: dictionary with keys 'nodes', 'registrations', 'preprints' where each has a list of resources as tuples
+    with form (guid, title, date_field)
+    """
+    resources = {resource_type: [] for resource_type in RESOURCE_DATE_FIELDS}
+
+    executor = get_executor(num_processes)
+    futures = [executor.submit(get_user_resources, guid, resource_type, 1, page_size) for resource_type in resources]
+
+    chunks = []
+    for resource_type, future in zip(resources, futures):
+        response = future.result()
+        if not response:
+            # failed first page is recorded in dead letter table, its replay gathers the remaining pages
+            continue
+
+        date_field = RESOURCE_DATE_FIELDS[resource_type]
+        resources[resource_type] = [
+            (node['id'], node['attributes']['title'], node['attributes'][date_field]) for node in response['data']
+        ]
+
+        pages = [num for num in range(2, ceil(response['links']['meta']['total'] / page_size) + 1)]
+        if not pages:
+            continue
+
+        chunk_len = ceil(len(pages) / num_processes)
+        chunks += [(guid, resource_type, pages[i:i + chunk_len], page_size) for i in range(0, len(pages), chunk_len)]
+
+    futures = [executor.submit(map_get_user_resources, *chunk) for chunk in chunks]
+    chunk_results = [future.result() for future in futures]
+
+    for chunk, result in zip(chunks, chunk_results):
+        resources[chunk[1]] += list(filter(lambda x: x is not None, result))
+
+    return resources
+
+
 def load_user_resources(resources, resource_type):
     """
-    Takes list of tuples representing node-level data and inserts into
+    Takes list of tuples representing node-level data and inserts or updates those whose content changed.
 
     :param resources: list of nodes from data key of of OSF API response for user nodes
     :param resource_type: one of 'nodes', 'registrations', 'preprints' to indicate what type of resource is provided
@@ -413,24 +546,33 @@ def load_user_resources(resources, resource_type):
     """
 
     if resource_type == 'nodes':
-        insert = 'INSERT OR REPLACE INTO nodes(id, title, date_created) VALUES (?, ?, ?)'
+        date_field = 'date_created'
     elif resource_type == 'registrations':
-        insert = 'INSERT OR REPLACE INTO registrations(id, title, date_registered) VALUES (?, ?, ?)'
+        date_field = 'date_registered'
     elif resource_type == 'preprints':
-        insert = 'INSERT OR REPLACE INTO preprints(id, title, date_published) VALUES (?, ?, ?)'
+        date_field = 'date_published'
     else:
         print('resource_type is not supported, exiting process')
         return
 
+    insert = f"""
+              INSERT INTO {resource_type}(id, title, {date_field}) VALUES (?, ?, ?)
+              ON CONFLICT(id) DO UPDATE SET title=excluded.title, {date_field}=excluded.{date_field}
+              WHERE title IS NOT excluded.title OR {date_field} IS NOT excluded.{date_field}
+              """
+
     conn = sqlite3.connect(db_name)
+    changed = find_changed(conn, resource_type, [(r[0], r) for r in resources if r])
     try:
-        conn.executemany(
-            insert,
-            resources
-        )
+        conn.executemany(insert, [c[1] for c in changed])
     except ValueError:
         print(f'load failed at {resource_type}')
         print(f'example input {resources[0]}')
+        # discard rows written before the failure, hashes are only recorded for loaded rows
+        conn.rollback()
+        conn.close()
+        return
 
+    record_changes(conn, resource_type, changed)
     conn.commit()
     conn.close()